@@ -0,0 +1,131 @@
+import argparse
+import collections
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import belote
+
+IN_FLIGHT = 4
+'''Positions sent to each worker ahead of the results read back, so input is read as it is searched'''
+
+_worker_transposition = None
+'''Transposition table kept warm across the positions this process searches'''
+
+def _init_worker(transposition_entries):
+    global _worker_transposition
+    _worker_transposition = belote.TranspositionTable(transposition_entries)
+
+def analyze_position(line, text, settings):
+    '''
+    Searches the position on one input line with the settings it doesn't set itself,
+    returns the points and standard error per card, the best card that can be played and
+    the timing of the search, or why the position could not be searched, with the line number
+    '''
+    result = {'line': line}
+    try:
+        position = json.loads(text)
+        result['id'] = position.get('id')
+        game = belote.position_game(position | {'settings': settings | position.get('settings', {})})
+        if _worker_transposition is not None:
+            game.transposition = _worker_transposition
+        start = time.perf_counter()
+        points = game.search_futures()
+        search_time = time.perf_counter() - start
+        hand = game.players[game.curr_turn].handrounds[game.round]
+        best = game.best_card(points) if points else None
+    except Exception as error:
+        # one bad line of a large log is reported on its own line, the others are still searched
+        return result | {'error': f'{type(error).__name__}: {error}'}
+    return result | {
+        'points': dict(zip(hand, points)),
+        'best': best,
+        'standard_errors': game.standard_errors,
+        'coverage': game.coverage,
+        'nodes': game.nodes,
+        'search_time': search_time,
+    }
+
+def analyze(lines, settings=None, workers=1, ordered=True, start=0, done=(),
+            transposition_entries=1 << 20):
+    '''
+    Yields the result of each position in lines from line start on, skipping blank lines
+    and the line numbers in done. Results come in input order, or as they complete when
+    not ordered, and only a few positions per worker are read ahead of them
+    '''
+    settings = settings or {}
+    numbered = ((line, text) for line, text in itertools.islice(enumerate(lines), start, None)
+                if text.strip() and line not in done)
+    if workers <= 1:
+        _init_worker(transposition_entries)
+        for line, text in numbered:
+            yield analyze_position(line, text, settings)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(transposition_entries,)) as pool:
+        pending = collections.deque() if ordered else set()
+        for line, text in numbered:
+            future = pool.submit(analyze_position, line, text, settings)
+            if ordered:
+                pending.append(future)
+                if len(pending) >= workers * IN_FLIGHT:
+                    yield pending.popleft().result()
+            else:
+                pending.add(future)
+                if len(pending) >= workers * IN_FLIGHT:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        yield future.result()
+        if ordered:
+            for future in pending:
+                yield future.result()
+        else:
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+
+def analyzed_lines(path):
+    '''Returns the line numbers an earlier run already wrote results for to path'''
+    try:
+        with open(path) as f:
+            return {json.loads(result)['line'] for result in f if result.strip()}
+    except FileNotFoundError:
+        return set()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Searches belote positions read as json lines, '
+                                     'one result line per position')
+    parser.add_argument('input', nargs='?', default='-', help='file of positions, - reads stdin')
+    parser.add_argument('--output', default='-', help='file the results are written to, - writes stdout')
+    parser.add_argument('--workers', type=int, default=1, help='processes searching positions')
+    parser.add_argument('--as-completed', action='store_true',
+                        help='write each result as soon as it is done instead of in input order')
+    parser.add_argument('--start', type=int, default=0, help='input line to start from, 0 is the first')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the positions --output already has results for and append to it')
+    parser.add_argument('--samples', type=int, default=0,
+                        help='random deals searched per position, 0 searches every deal')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='seconds a position may search for')
+    parser.add_argument('--minimax', action='store_true',
+                        help='score the best card for both teams instead of the best average')
+    args = parser.parse_args()
+    if args.resume and args.output == '-':
+        parser.error('--resume needs an --output file')
+    settings = {'samples': args.samples, 'time_budget': args.time_budget}
+    if args.minimax:
+        settings['search_mode'] = 'minimax'
+    done = analyzed_lines(args.output) if args.resume else set()
+    source = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, 'a' if args.resume else 'w')
+    try:
+        for result in analyze(source, settings, args.workers, not args.as_completed, args.start, done):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
@@ -1,7 +1,13 @@
+import collections
 import copy
 import itertools
 import enum
+import math
+import mmap
+import random
+import struct
 import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import timedelta
 import numpy
 
@@ -12,37 +18,72 @@ class PrintLevel(enum.IntEnum):
     INFO = 3
     EXTRA_INFO = 4
 
+SUITS = ['♣','♦','♥','♠']
+'''Suit symbols in encoding order'''
+RANKS = ['A','K','Q','J','10','9','8','7']
+'''Card ranks in encoding order'''
+NO_TRUMP = len(SUITS)
+'''Encoded trump index used when no trump is set'''
+NO_CARD = 32
+'''Encoded empty table slot, one past the last card so tricks can index the trick tables'''
+MINIMAX_KEY = 1 << 133
+'''Position key bit that keeps minimax bounds apart from averaged futures'''
+SINGLE_DEAL = ((None, 1),)
+'''A deal that only stands for itself'''
+MAX_POINTS = 1000
+'''More points than a team can score in a game'''
+BUDGET_INTERVAL = 1024
+'''Cards played in futures between checks of the search budget'''
+
+POINTS = {'A': 11, 'K': 4, 'Q': 3, 'J': 2, '10': 10, '9': 0, '8': 0, '7': 0}
+TRUMP_POINTS = {'A': 11, 'K': 4, 'Q': 3, 'J': 20, '10': 10, '9': 14, '8': 0, '7': 0}
+
+# Cards are encoded as small ints (suit * 8 + rank) and hands as bitmasks of
+# those ints. Everything below is precomputed once so the search never touches
+# strings.
+CARD_NAMES = [rank + suit for suit in SUITS for rank in RANKS]
+'''Card string per encoded card'''
+CARD_CODES = {name: code for code,name in enumerate(CARD_NAMES)}
+'''Encoded card per card string'''
+SUIT_CODES = {suit: ix for ix,suit in enumerate(SUITS)}
+'''Encoded suit per suit symbol'''
+CARD_SUIT = [code // len(RANKS) for code in range(len(CARD_NAMES))]
+'''Encoded suit per encoded card'''
+SUIT_MASKS = [sum(1 << code for code in range(len(CARD_NAMES)) if CARD_SUIT[code] == suit)
+              for suit in range(len(SUITS))] + [0]
+'''Bitmask of every card in a suit, indexed by encoded suit (NO_TRUMP is empty)'''
+CARD_POINTS = [[(TRUMP_POINTS if CARD_SUIT[code] == trump else POINTS)[RANKS[code % len(RANKS)]]
+                for code in range(len(CARD_NAMES))] for trump in range(len(SUITS) + 1)]
+'''Points per encoded card, indexed by encoded trump'''
+GAME_POINTS = max(sum(points) for points in CARD_POINTS)
+'''Most points a team can win over the tricks of a game'''
+HIGHER_MASKS = [[sum(1 << other for other in range(len(CARD_NAMES))
+                     if CARD_SUIT[other] == CARD_SUIT[code]
+                     and CARD_POINTS[trump][other] > CARD_POINTS[trump][code])
+                 for code in range(len(CARD_NAMES))] for trump in range(len(SUITS) + 1)]
+'''Bitmask of same suit cards worth more than a card, indexed by encoded trump'''
+EQUAL_MASKS = [[sum(1 << other for other in range(len(CARD_NAMES))
+                    if CARD_SUIT[other] == CARD_SUIT[code]
+                    and CARD_POINTS[trump][other] == CARD_POINTS[trump][code])
+                for code in range(len(CARD_NAMES))] for trump in range(len(SUITS) + 1)]
+'''Bitmask of same suit cards worth the same points as a card, they win and score alike, indexed by encoded trump'''
+GROUPED_CARDS = [sum(1 << code for code in range(len(CARD_NAMES)) if masks[code] != 1 << code)
+                 for masks in EQUAL_MASKS]
+'''Bitmask of the cards worth the same points as another card of their suit, indexed by encoded trump'''
+TRICK_STRENGTH = [[[100 + CARD_POINTS[trump][code] if CARD_SUIT[code] == trump
+                    else CARD_POINTS[trump][code] if CARD_SUIT[code] == lead_suit
+                    else -1
+                    for code in range(len(CARD_NAMES))]
+                   for lead_suit in range(len(SUITS))] for trump in range(len(SUITS) + 1)]
+'''Strength of a card in a trick, indexed by encoded trump and lead suit'''
+
+SUIT_POINTS = [[[sum(CARD_POINTS[trump][suit*len(RANKS) + rank] for rank in range(len(RANKS))
+                     if bits >> rank & 1) for bits in range(1 << len(RANKS))]
+                for suit in range(len(SUITS))] for trump in range(len(SUITS) + 1)]
+'''Points per 8 bit block of a suit in a hand, indexed by encoded trump and suit'''
+
 def cardPoints(card, trump):
-    pointDict = {
-            'A': 11,
-            'K': 4,
-            'Q': 3,
-            'J': 2,
-            '10': 10,
-            '9': 0,
-            '8': 0,
-            '7': 0
-            }
-    trumpDict = {
-            'A': 11,
-            'K': 4,
-            'Q': 3,
-            'J': 20,
-            '10': 10,
-            '9': 14,
-            '8': 0,
-            '7': 0
-            }
-    if len(card) == 3:
-        if card[2] == trump:
-            return trumpDict[card[:2]]
-        else:
-            return pointDict[card[:2]]
-    else:
-        if card[1] == trump:
-            return trumpDict[card[:1]]
-        else:
-            return pointDict[card[:1]]
+    return CARD_POINTS[SUIT_CODES.get(trump, NO_TRUMP)][CARD_CODES[card]]
 
 def get_card_suit(card):
     if not card:
@@ -52,9 +93,147 @@ def get_card_suit(card):
     else:
         return card[1]
 
+def encode_card(card):
+    '''Returns the encoded card, empty strings become NO_CARD'''
+    return CARD_CODES[card] if card else NO_CARD
+
+def decode_card(code):
+    '''Returns the card string, NO_CARD becomes an empty string'''
+    return CARD_NAMES[code] if code != NO_CARD else ''
+
+def encode_trump(trump):
+    '''Returns the encoded trump suit, anything unknown is NO_TRUMP'''
+    return SUIT_CODES.get(trump, NO_TRUMP)
+
+def encode_hand(cards):
+    '''Returns the bitmask of a list of card strings'''
+    mask = 0
+    for card in cards:
+        mask |= 1 << CARD_CODES[card]
+    return mask
+
+def mask_points(trump, mask):
+    '''Returns the total points of every card in the bitmask'''
+    suit_points = SUIT_POINTS[trump]
+    return (suit_points[0][mask & 0xff] + suit_points[1][mask >> 8 & 0xff]
+            + suit_points[2][mask >> 16 & 0xff] + suit_points[3][mask >> 24 & 0xff])
+
+TRICK_SLOTS = NO_CARD + 1
+'''Values a table slot can hold, every card and NO_CARD'''
+TRICK_SIZE = TRICK_SLOTS ** 4
+'''Tricks per lead position in a trick table'''
+TRICK_WEIGHTS = numpy.array([TRICK_SLOTS ** pos for pos in range(4)])
+'''Weight of each table slot in a trick table index'''
+TRICK_TABLES = [None] * (len(SUITS) + 1)
+'''Trick table per encoded trump as bytes, built the first time the trump is used'''
+TRICK_ARRAYS = [None] * (len(SUITS) + 1)
+'''Trick table per encoded trump as a numpy array for batches'''
+
+def build_trick_table(trump):
+    '''
+    Solves every trick for a trump at once, each entry packs the winning
+    position in the top two bits and the total points in the bottom six
+
+    Tricks are indexed by lead position * TRICK_SIZE + the weighted table slots
+    '''
+    # every array is a byte per trick so building a table only takes a few of them
+    slots = numpy.arange(TRICK_SLOTS, dtype=numpy.uint8)
+    # broadcast views of the card in each table slot, the first slot varies fastest
+    cards = [slots.reshape([TRICK_SLOTS if axis == 3 - pos else 1 for axis in range(4)]) for pos in range(4)]
+    points = numpy.array(CARD_POINTS[trump] + [0], numpy.uint8)
+    suits = numpy.array(CARD_SUIT + [NO_TRUMP], numpy.uint8)
+    # empty slots and tricks without a lead never win
+    strength = numpy.array([row + [-2] for row in TRICK_STRENGTH[trump]] + [[-2] * TRICK_SLOTS],
+                           numpy.int8)
+    total = (points[cards[0]] + points[cards[1]] + points[cards[2]] + points[cards[3]]).ravel()
+    table = numpy.empty(4 * TRICK_SIZE, numpy.uint8)
+    for lead_pos in range(4):
+        lead_suit = suits[cards[lead_pos]]
+        best = strength[lead_suit, cards[lead_pos]]
+        winner = numpy.full((TRICK_SLOTS,) * 4, lead_pos, numpy.uint8)
+        for i in range(1, 4):
+            pos = (lead_pos + i) % 4
+            card_strength = strength[lead_suit, cards[pos]]
+            # only a stronger card wins so the first card played keeps a tie
+            numpy.copyto(winner, pos, where=card_strength > best)
+            best = numpy.maximum(best, card_strength)
+        table[lead_pos*TRICK_SIZE:(lead_pos + 1)*TRICK_SIZE] = winner.ravel() << 6 | total
+    TRICK_ARRAYS[trump] = table
+    TRICK_TABLES[trump] = table.tobytes()
+    return TRICK_TABLES[trump]
+
+def trick_winner(trump, lead_pos, trick):
+    '''
+    Given an encoded trick with the lead position and trump
+    return the total points and winning position
+    '''
+    packed = (TRICK_TABLES[trump] or build_trick_table(trump))[
+        lead_pos*TRICK_SIZE + trick[0] + TRICK_SLOTS*(trick[1] + TRICK_SLOTS*(trick[2] + TRICK_SLOTS*trick[3]))]
+    return packed & 63, packed >> 6
+
+def resolve_tricks(trump, lead_pos, tricks):
+    '''
+    Returns the total points and winning positions of many encoded tricks in one array call,
+    tricks is an array of 4 table slots per trick and lead_pos one or one per trick
+    '''
+    if TRICK_ARRAYS[trump] is None:
+        build_trick_table(trump)
+    packed = TRICK_ARRAYS[trump][numpy.asarray(lead_pos) * TRICK_SIZE
+                                 + numpy.asarray(tricks) @ TRICK_WEIGHTS]
+    return packed & 63, packed >> 6
+
+def equal_card_groups(valid, trump):
+    '''
+    Returns the valid cards with one card kept of each group of same suit cards worth the
+    same points, and the cards each kept card stands for, None when no cards were grouped
+
+    A trick is won by the card worth the most points of the lead suit or trump, so cards
+    of a group play out alike and lead to the same futures, wherever the others are
+    '''
+    kept = valid
+    groups = None
+    rest = valid
+    while rest:
+        card = rest & -rest
+        same = valid & EQUAL_MASKS[trump][card.bit_length() - 1]
+        rest &= ~same
+        if same != card:
+            kept &= ~same | card
+            if groups is None:
+                groups = {}
+            groups[card.bit_length() - 1] = bin(same).count('1')
+    return kept, groups
+
+def valid_mask(hand, trump, trick, lead_pos, turn, card_played):
+    '''Returns the bitmask of cards in the hand that can be played on the trick'''
+    if card_played == 0:
+        return hand
+    lead_suit = CARD_SUIT[trick[lead_pos]]
+    follow = hand & SUIT_MASKS[lead_suit]
+    # can follow suit
+    if follow:
+        # can follow suit trump - need to play higher
+        if lead_suit == trump:
+            _, wi = trick_winner(trump, lead_pos, trick)
+            return (follow & HIGHER_MASKS[trump][trick[wi]]) or follow
+        return follow
+    # can't follow suit - partner is winning, no need to play trump
+    _, wi = trick_winner(trump, lead_pos, trick)
+    if wi == (turn + 2) & 3:
+        return hand
+    trumps = hand & SUIT_MASKS[trump]
+    # can't follow suit and can't cut - throw off
+    if not trumps:
+        return hand
+    # trump has been played - must play higher if possible
+    if CARD_SUIT[trick[wi]] == trump:
+        return (trumps & HIGHER_MASKS[trump][trick[wi]]) or trumps
+    return trumps
+
 class Table:
     def __init__(self):
         self.cards = [['','','',''] for _ in range(8)]
+        self.leads = ['' for _ in range(8)]
 
 class Player:
     def __init__(self, id):
@@ -62,6 +241,1035 @@ class Player:
         self.hand = []
         self.handrounds = [[] for _ in range(8)]
 
+_zobrist = random.Random('belote-zobrist')
+ZOBRIST_HANDS = [[_zobrist.getrandbits(64) for _ in range(len(CARD_NAMES))] for _ in range(4)]
+'''Random key of each card in each hand, a state's hash xors the keys of all it holds'''
+ZOBRIST_TRICK = [[_zobrist.getrandbits(64) for _ in range(len(CARD_NAMES))] + [0] for _ in range(4)]
+'''Random key of each card on the table per position, an empty slot has none'''
+ZOBRIST_TURN = [_zobrist.getrandbits(64) for _ in range(4 * 4 * 4)]
+'''Random key per player to play, lead position and cards played in the round'''
+ZOBRIST_ROUND = [_zobrist.getrandbits(64) for _ in range(9)]
+'''Random key per round, 8 once the game is over'''
+ZOBRIST_TRUMP = [_zobrist.getrandbits(64) for _ in range(len(SUITS) + 1)]
+'''Random key per encoded trump'''
+
+class GameState:
+    '''
+    A whole position in a few ints, cheap to copy, compare and hash
+
+    Hands and the cards played are bitmasks, the trick is the encoded cards per
+    position. The hash is the xor of random keys for everything in the position,
+    so playing a card only swaps the few keys it changes. Points scored are kept
+    but not hashed, the futures from a position don't depend on them
+    '''
+    __slots__ = ('hands', 'trick', 'played', 'curr_turn', 'card_played', 'round', 'lead_pos',
+                 'trump', 'team_points', 'key')
+
+    def __init__(self, hands, trick, curr_turn, card_played, round, lead_pos, trump, played=0,
+                 team_points=(0, 0)):
+        self.hands = list(hands)
+        '''Encoded hand per player'''
+        self.trick = list(trick)
+        '''Encoded card per position on the table this round, NO_CARD when not played'''
+        self.played = played
+        '''Bitmask of the cards played so far'''
+        self.curr_turn = curr_turn
+        '''Player to play [0..3]'''
+        self.card_played = card_played
+        '''Cards played this round [0..3]'''
+        self.round = round
+        '''Round [0..7], 8 once the game is over'''
+        self.lead_pos = lead_pos if card_played else curr_turn
+        '''Position that led the round, the player to play before anyone has'''
+        self.trump = trump
+        '''Encoded trump'''
+        self.team_points = list(team_points)
+        '''Points per team'''
+        self.key = self.compute_key()
+        '''Hash of the position, kept up to date as cards are played'''
+
+    def compute_key(self):
+        '''Returns the hash of the position worked out from scratch'''
+        key = (ZOBRIST_TURN[(self.curr_turn*4 + self.lead_pos)*4 + self.card_played]
+               ^ ZOBRIST_ROUND[self.round] ^ ZOBRIST_TRUMP[self.trump])
+        for player, hand in enumerate(self.hands):
+            while hand:
+                card = hand & -hand
+                hand ^= card
+                key ^= ZOBRIST_HANDS[player][card.bit_length() - 1]
+            key ^= ZOBRIST_TRICK[player][self.trick[player]]
+        return key
+
+    def copy(self):
+        state = GameState.__new__(GameState)
+        state.hands = self.hands[:]
+        state.trick = self.trick[:]
+        state.played = self.played
+        state.curr_turn = self.curr_turn
+        state.card_played = self.card_played
+        state.round = self.round
+        state.lead_pos = self.lead_pos
+        state.trump = self.trump
+        state.team_points = self.team_points[:]
+        state.key = self.key
+        return state
+
+    def valid(self):
+        '''Returns the bitmask of the cards the player to play can play'''
+        return valid_mask(self.hands[self.curr_turn], self.trump, self.trick, self.lead_pos,
+                          self.curr_turn, self.card_played)
+
+    def play(self, card):
+        '''
+        Plays the encoded card for the player to play and moves on to the next one,
+        solving the set after the fourth card. Returns the points and winner of the
+        set then, None before
+        '''
+        turn = self.curr_turn
+        key = self.key ^ ZOBRIST_TURN[(turn*4 + self.lead_pos)*4 + self.card_played]
+        key ^= ZOBRIST_HANDS[turn][card] ^ ZOBRIST_TRICK[turn][card]
+        self.hands[turn] ^= 1 << card
+        self.trick[turn] = card
+        self.played |= 1 << card
+        solved = None
+        if self.card_played < 3:
+            self.curr_turn = turn + 1 if turn + 1 < 4 else 0
+            self.card_played += 1
+        else:
+            total, winningidx = trick_winner(self.trump, self.lead_pos, self.trick)
+            self.team_points[winningidx % 2] += total
+            for position, played in enumerate(self.trick):
+                key ^= ZOBRIST_TRICK[position][played]
+            self.trick = [NO_CARD] * 4
+            key ^= ZOBRIST_ROUND[self.round] ^ ZOBRIST_ROUND[self.round + 1]
+            self.round += 1
+            self.curr_turn = self.lead_pos = winningidx
+            self.card_played = 0
+            solved = total, winningidx
+        self.key = key ^ ZOBRIST_TURN[(self.curr_turn*4 + self.lead_pos)*4 + self.card_played]
+        return solved
+
+    def __hash__(self):
+        return self.key
+
+    def __eq__(self, other):
+        if not isinstance(other, GameState):
+            return NotImplemented
+        return (self.key == other.key and self.hands == other.hands and self.trick == other.trick
+                and self.played == other.played and self.curr_turn == other.curr_turn
+                and self.card_played == other.card_played and self.round == other.round
+                and self.lead_pos == other.lead_pos and self.trump == other.trump
+                and self.team_points == other.team_points)
+
+    @classmethod
+    def from_game(cls, game):
+        '''Returns the position a Game is at'''
+        hands = [0, 0, 0, 0]
+        trick = [NO_CARD] * 4
+        if game.round < 8:
+            trick = [encode_card(card) for card in game.table.cards[game.round]]
+            for ix,p in enumerate(game.players):
+                # the hand of the round still holds the card its player put on the table
+                hands[ix] = encode_hand(p.handrounds[game.round])
+                if trick[ix] != NO_CARD:
+                    hands[ix] &= ~(1 << trick[ix])
+        lead_pos = trick.index(CARD_CODES[game.lead]) if game.card_played else game.curr_turn
+        return cls(hands, trick, game.curr_turn, game.card_played, game.round, lead_pos,
+                   encode_trump(game.trump), encode_hand(game.deck_played), game.team_points)
+
+    def to_game(self, game):
+        '''Sets the fields of a Game to the position, lists already holding the same cards keep their order'''
+        def cards(mask, kept):
+            if encode_hand(kept) == mask:
+                return list(kept)
+            return [CARD_NAMES[code] for code in range(len(CARD_NAMES)) if mask >> code & 1]
+
+        game.trump = SUITS[self.trump] if self.trump < len(SUITS) else ''
+        game.round = self.round
+        game.curr_turn = self.curr_turn
+        game.card_played = self.card_played
+        game.team_points = self.team_points[:]
+        game.deck_played = cards(self.played, game.deck_played)
+        if self.round > 7:
+            return
+        game.table.cards[self.round] = [decode_card(card) for card in self.trick]
+        game.lead = decode_card(self.trick[self.lead_pos]) if self.card_played else ''
+        game.table.leads[self.round] = game.lead
+        for ix,p in enumerate(game.players):
+            on_table = 1 << self.trick[ix] if self.trick[ix] != NO_CARD else 0
+            p.handrounds[self.round] = cards(self.hands[ix] | on_table, p.handrounds[self.round])
+
+class SearchMode(enum.IntEnum):
+    AVERAGE = 0
+    '''Average the points of every possible future'''
+    MINIMAX = 1
+    '''Best points when both teams play their best cards in every deal'''
+
+class HookEvent(enum.IntEnum):
+    CALCULATE_START = 0
+    '''A candidate card is about to be searched against a deal'''
+    CALCULATE_END = 1
+    '''A candidate card was searched against a deal'''
+    SOLVE_SET_START = 2
+    '''A set is about to be solved, by solveSet or a search (a whole batch of sets in the batched search)'''
+    SOLVE_SET_END = 3
+    '''A set was solved, by solveSet or a search (a whole batch of sets in the batched search)'''
+    BUDGET_CHECK = 4
+    '''A search checks its budget, a hook can raise BudgetExceeded to stop it early'''
+
+class TranspositionTable:
+    '''
+    Bounded store of solved subtrees keyed by position
+
+    Each entry holds the leaf totals of the subtree relative to the points
+    scored before it, as (points, count) pairs from team A's side, so a
+    repeated position reproduces exactly the leaves it would have searched
+    '''
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        '''Memory cap in positions, the oldest position is evicted first'''
+        self.entries = {}
+        '''Position key to leaf totals'''
+        self.hits = 0
+        '''Tracks how many lookups were found'''
+        self.misses = 0
+        '''Tracks how many lookups were not found'''
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        if len(self.entries) >= self.max_entries:
+            # dicts keep insertion order, the first key is the oldest
+            del self.entries[next(iter(self.entries))]
+        self.entries[key] = entry
+
+    def drop_cards(self, cards):
+        '''Drops the positions where a player still holds one of the cards, they can't come up again'''
+        held = cards | cards << 32 | cards << 64 | cards << 96
+        self.entries = {key: entry for key, entry in self.entries.items() if not key & held}
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+class PointsAggregate:
+    '''
+    Running summary of the points of every future a card leads to
+
+    Futures are added as they are reached instead of kept, the full list of
+    points is only kept when asked for to debug a search
+    '''
+    def __init__(self, bins=0, keep_leaves=False):
+        self.count = 0
+        '''Futures added'''
+        self.total = 0
+        '''Sum of the points of the futures'''
+        self.squares = 0
+        '''Sum of the squared points of the futures'''
+        self.low = None
+        '''Fewest points of a future, None before any was added'''
+        self.high = None
+        '''Most points of a future, None before any was added'''
+        self.histogram = [0] * bins if bins > 0 else None
+        '''Futures per equal width bin of points from -GAME_POINTS to GAME_POINTS'''
+        self.leaves = [] if keep_leaves else None
+        '''Points of every future in the order added when kept'''
+
+    def add(self, points, count=1):
+        '''Adds count futures ending on the points'''
+        self.count += count
+        self.total += points * count
+        self.squares += points * points * count
+        if self.low is None or points < self.low:
+            self.low = points
+        if self.high is None or points > self.high:
+            self.high = points
+        if self.histogram is not None:
+            self.histogram[self.bin(points)] += count
+        if self.leaves is not None:
+            self.leaves.extend([points] * count)
+
+    def add_leaves(self, leaves, weight=1):
+        '''Adds the futures of leaves, the number of futures per points they end on, weight times'''
+        for points, count in leaves.items():
+            self.add(points, count * weight)
+
+    def merge(self, other):
+        '''Adds the futures summed up in other'''
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        if self.low is None or other.low < self.low:
+            self.low = other.low
+        if self.high is None or other.high > self.high:
+            self.high = other.high
+        if self.histogram is not None:
+            for ix,count in enumerate(other.histogram):
+                self.histogram[ix] += count
+        if self.leaves is not None:
+            self.leaves.extend(other.leaves)
+
+    def as_dict(self):
+        '''Returns the summary as a dict of plain values, to be sent as json'''
+        return {'count': self.count, 'total': self.total, 'squares': self.squares, 'low': self.low,
+                'high': self.high, 'histogram': self.histogram, 'leaves': self.leaves}
+
+    @classmethod
+    def from_dict(cls, summary):
+        '''Returns the aggregate of a summary from as_dict'''
+        aggregate = cls()
+        for name in ('count', 'total', 'squares', 'low', 'high', 'histogram', 'leaves'):
+            setattr(aggregate, name, summary[name])
+        return aggregate
+
+    def bin(self, points):
+        '''Returns the histogram bin the points fall in'''
+        return (points + GAME_POINTS) * len(self.histogram) // (2*GAME_POINTS + 1)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def variance(self):
+        if not self.count:
+            return 0.0
+        mean = self.total / self.count
+        return max(self.squares / self.count - mean * mean, 0.0)
+
+TRACE_MAGIC = b'BELOTE-TRACE-1\n'
+'''Start of a binary trace file'''
+TRACE_RECORD = struct.Struct('7B')
+'''Binary trace record of a solved set: the 4 encoded table slots, lead position, winner and points'''
+
+class TraceRecorder:
+    '''
+    Records solved sets as fixed size binary records instead of formatting them
+
+    The last capacity sets are kept in a ring buffer, every set is also written
+    to the file at path when one is given so it can be decoded with read_trace
+    '''
+    def __init__(self, capacity=1 << 16, path=None):
+        self.records = collections.deque(maxlen=capacity)
+        '''Last sets recorded as binary records'''
+        self.count = 0
+        '''Sets recorded, including the ones the ring buffer dropped'''
+        self.file = None
+        '''Binary trace file every set is written to, None writes no file'''
+        if path is not None:
+            self.file = open(path, 'wb')
+            self.file.write(TRACE_MAGIC)
+
+    def record(self, trick, lead_pos, winningidx, total):
+        record = TRACE_RECORD.pack(trick[0], trick[1], trick[2], trick[3], lead_pos, winningidx, total)
+        self.records.append(record)
+        self.count += 1
+        if self.file is not None:
+            self.file.write(record)
+
+    def sets(self):
+        '''Returns the sets in the ring buffer decoded, oldest first'''
+        return [decode_trace_record(record) for record in self.records]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def decode_trace_record(record):
+    '''Returns the cards on the table, lead position, winner and points of a binary trace record'''
+    *trick, lead_pos, winningidx, total = TRACE_RECORD.unpack(record)
+    return [decode_card(card) for card in trick], lead_pos, winningidx, total
+
+def read_trace(path):
+    '''Yields every set of a binary trace file decoded, in the order they were solved'''
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f'{path} is not a belote trace file')
+        data = f.read()
+    for record in TRACE_RECORD.iter_unpack(data):
+        *trick, lead_pos, winningidx, total = record
+        yield [decode_card(card) for card in trick], lead_pos, winningidx, total
+
+class SearchStats:
+    '''
+    Counts of where a search spends its work, only collected when asked for
+
+    Times are measured around each call so they include the cost of timing it
+    '''
+    def __init__(self):
+        self.deals = 0
+        '''Deals enumerated, one per class of deals when they are canonical'''
+        self.nodes = [0] * len(CARD_NAMES)
+        '''Positions a card was picked in, indexed by the card of the game (round * 4 + card_played)'''
+        self.moves = 0
+        '''Legal cards over every position searched'''
+        self.tricks = 0
+        '''Tricks solved'''
+        self.deal_time = 0.0
+        '''Seconds spent generating deals'''
+        self.legality_time = 0.0
+        '''Seconds spent finding the legal cards'''
+        self.scoring_time = 0.0
+        '''Seconds spent solving tricks'''
+        self.search_time = 0.0
+        '''Seconds the whole search took'''
+
+    def add_node(self, round, card_played, valid, started):
+        '''Counts a position and its legal cards found since started'''
+        self.legality_time += time.perf_counter() - started
+        self.nodes[round*4 + card_played] += 1
+        self.moves += bin(valid).count('1')
+
+    def add_trick(self, started, tricks=1):
+        '''Counts tricks solved since started'''
+        self.scoring_time += time.perf_counter() - started
+        self.tricks += tricks
+
+    def branching_factor(self):
+        '''Average legal cards per position searched'''
+        nodes = sum(self.nodes)
+        return self.moves / nodes if nodes else 0.0
+
+    def merge(self, other):
+        '''Adds the counts from other'''
+        self.deals += other.deals
+        self.nodes = [a + b for a, b in zip(self.nodes, other.nodes)]
+        self.moves += other.moves
+        self.tricks += other.tricks
+        self.deal_time += other.deal_time
+        self.legality_time += other.legality_time
+        self.scoring_time += other.scoring_time
+
+class BudgetExceeded(Exception):
+    '''Raised inside a search once its time or node budget runs out'''
+
+class DealIndex:
+    '''
+    Numbers every way to deal the deck into hands of the given sizes
+
+    Deals are numbered in the order get_all_hands has always dealt them: the
+    first hand takes combinations of the deck in deck order, the later hands of
+    the cards left in sorted order. Any number maps straight to its deal and
+    back, so deals can be searched from any point or split into exact shards
+
+    Hands can be kept from holding some cards, then only the deals where no
+    hand holds a card it can't are numbered, in the same order
+    '''
+    def __init__(self, deck, hand_sizes, excluded=None):
+        self.hand_sizes = list(hand_sizes)
+        '''Cards in each hand'''
+        self.excluded = [frozenset(cards) for cards in excluded] if excluded and any(excluded) else None
+        '''Cards each hand can't hold, None when every hand can hold every card'''
+        self.orders = [list(deck)] + [sorted(deck)] * (len(self.hand_sizes) - 1)
+        '''Order each hand picks its cards from the cards left in'''
+        self.hand_counts = []
+        '''Ways to deal each hand from the cards left after the hands before it'''
+        left = len(deck)
+        for size in self.hand_sizes:
+            self.hand_counts.append(math.comb(left, size) if 0 <= size <= left else 0)
+            left -= size
+        self.strides = [math.prod(self.hand_counts[ix + 1:]) for ix in range(len(self.hand_sizes))]
+        '''Deals between one hand of each position and the next, when no cards are excluded'''
+        self.count = self.completions(0, deck)
+        '''Number of deals'''
+
+    def left(self, ix, dealt):
+        '''Cards hand ix picks from once the hands dealt are taken out'''
+        used = set(itertools.chain.from_iterable(dealt))
+        return [card for card in self.orders[ix] if card not in used]
+
+    def allowed(self, ix, cards):
+        '''Cards hand ix can hold out of cards'''
+        if self.excluded is None or not self.excluded[ix]:
+            return cards
+        return [card for card in cards if card not in self.excluded[ix]]
+
+    def completions(self, ix, cards):
+        '''Returns the number of ways to deal the hands from ix onward out of cards'''
+        sizes = self.hand_sizes[ix:]
+        if self.excluded is None:
+            count = 1
+            left = len(cards)
+            for size in sizes:
+                if not 0 <= size <= left:
+                    return 0
+                count *= math.comb(left, size)
+                left -= size
+            return count
+        # cards that the same hands can hold are dealt together, the rest go to nobody
+        groups = list(collections.Counter(tuple(card not in excluded for excluded in self.excluded[ix:])
+                                          for card in cards).items())
+        memo = {}
+
+        def splits(size, caps, allowed, player):
+            if player == len(caps):
+                yield ()
+                return
+            most = min(size, caps[player]) if allowed[player] else 0
+            for count in range(most + 1):
+                for tail in splits(size - count, caps, allowed, player + 1):
+                    yield (count,) + tail
+
+        def ways(group, caps):
+            if group == len(groups):
+                return 0 if any(caps) else 1
+            key = group, caps
+            if key not in memo:
+                allowed, size = groups[group]
+                total = 0
+                for split in splits(size, caps, allowed, 0):
+                    dealt = math.factorial(size) // math.factorial(size - sum(split))
+                    for count in split:
+                        dealt //= math.factorial(count)
+                    total += dealt * ways(group + 1, tuple(cap - count for cap, count in zip(caps, split)))
+                memo[key] = total
+            return memo[key]
+
+        return ways(0, tuple(sizes))
+
+    def deal(self, index):
+        '''Returns the hands of the deal numbered index'''
+        if not 0 <= index < self.count:
+            raise IndexError(f'Deal {index} is not in 0..{self.count - 1}')
+        hands = []
+        for ix,size in enumerate(self.hand_sizes):
+            cards = self.left(ix, hands)
+            if self.excluded is None:
+                rank = index // self.strides[ix] % self.hand_counts[ix]
+                hands.append(unrank_combination(cards, size, rank))
+                continue
+            # skip whole blocks of deals that start with an earlier hand
+            for hand in itertools.combinations(self.allowed(ix, cards), size):
+                block = self.completions(ix + 1, [card for card in cards if card not in hand])
+                if index < block:
+                    hands.append(hand)
+                    break
+                index -= block
+        return hands
+
+    def index(self, hands):
+        '''Returns the number of the deal with the hands'''
+        index = 0
+        for ix,hand in enumerate(hands):
+            cards = self.left(ix, hands[:ix])
+            if self.excluded is None:
+                positions = sorted(cards.index(card) for card in hand)
+                index += rank_combination(len(cards), positions) * self.strides[ix]
+                continue
+            hand = tuple(card for card in cards if card in hand)
+            for other in itertools.combinations(self.allowed(ix, cards), len(hand)):
+                if other == hand:
+                    break
+                index += self.completions(ix + 1, [card for card in cards if card not in other])
+        return index
+
+    def deals(self, start=0, stop=None):
+        '''Yields the deals numbered start up to stop in order'''
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        first = self.deal(start)
+        # only hands with cards are picked, empty hands are filled in around them
+        picks = [ix for ix,size in enumerate(self.hand_sizes) if size]
+        if not picks:
+            yield first
+            return
+        gaps = [[()] * (ix - prev - 1) for prev, ix in zip([-1] + picks, picks)]
+        tail = [()] * (len(self.hand_sizes) - picks[-1] - 1)
+
+        def hand_deals(k, cards, resume):
+            ix = picks[k]
+            deals = itertools.combinations(self.allowed(ix, cards), self.hand_sizes[ix])
+            if resume:
+                # only the first pass through each hand starts part way
+                deals = itertools.dropwhile(first[ix].__ne__, deals)
+            return deals
+
+        def cards_left(k, cards, hand):
+            if picks[k] == 0:
+                # every hand after the first picks from the cards left in sorted order
+                cards = set(cards) - set(hand)
+                return [card for card in self.orders[picks[k + 1]] if card in cards]
+            return [card for card in cards if card not in hand]
+
+        def deal_from(k, hands, cards, resume):
+            if k == len(picks) - 1:
+                for hand in hand_deals(k, cards, resume):
+                    yield [*hands, hand, *tail]
+                return
+            if k == len(picks) - 2:
+                # the last two hands are dealt here, the deepest generator yields every deal
+                last = self.hand_sizes[picks[-1]]
+                gap = gaps[k + 1]
+                for hand in hand_deals(k, cards, resume):
+                    prefix = [*hands, hand, *gap]
+                    deals = itertools.combinations(
+                        self.allowed(picks[-1], cards_left(k, cards, hand)), last)
+                    if resume:
+                        deals = itertools.dropwhile(first[picks[-1]].__ne__, deals)
+                        resume = False
+                    for last_hand in deals:
+                        yield [*prefix, last_hand, *tail]
+                return
+            for hand in hand_deals(k, cards, resume):
+                yield from deal_from(k + 1, [*hands, hand, *gaps[k + 1]], cards_left(k, cards, hand),
+                                     resume)
+                resume = False
+
+        yield from itertools.islice(deal_from(0, gaps[0], self.orders[picks[0]], True), stop - start)
+
+    def shard(self, shard, shards):
+        '''Returns the start and stop of the deals in shard of shards equal shards'''
+        return self.count * shard // shards, self.count * (shard + 1) // shards
+
+    def sample(self, rng):
+        '''Returns a deal picked uniformly at random'''
+        return self.deal(rng.randrange(self.count))
+
+    def shuffled(self, rng):
+        '''Yields the number of every deal once in random order, so any first deals are a uniform sample'''
+        # a Fisher-Yates shuffle that only keeps the deal numbers it moved, so the first deals
+        # come straight away however many there are
+        moved = {}
+        for ix in range(self.count):
+            swap = rng.randrange(ix, self.count)
+            index = moved.get(swap, swap)
+            moved[swap] = moved.get(ix, ix)
+            # every deal number up to ix is already out
+            moved.pop(ix, None)
+            yield index
+
+def unrank_combination(cards, size, rank):
+    '''Returns the combination of size cards numbered rank in itertools.combinations order'''
+    hand = []
+    start = 0
+    for picked in range(size):
+        for ix in range(start, len(cards)):
+            count = math.comb(len(cards) - ix - 1, size - picked - 1)
+            if rank < count:
+                hand.append(cards[ix])
+                start = ix + 1
+                break
+            rank -= count
+    return tuple(hand)
+
+def rank_combination(n, positions):
+    '''Returns the number of the combination of the sorted positions out of n in itertools.combinations order'''
+    rank = 0
+    start = 0
+    size = len(positions)
+    for picked, position in enumerate(positions):
+        for ix in range(start, position):
+            rank += math.comb(n - ix - 1, size - picked - 1)
+        start = position + 1
+    return rank
+
+def position_key(hands, curr_turn, trump):
+    '''Returns a unique key for the start of a round from the hands, leader and trump'''
+    return (hands[0] | hands[1] << 32 | hands[2] << 64 | hands[3] << 96
+            | curr_turn << 128 | trump << 130)
+
+def merge_aggregates(card_stats, other):
+    '''Adds the futures summed up per card in other into card_stats'''
+    for card, stats in other.items():
+        card_stats[card].merge(stats)
+
+TABLEBASE_MAGIC = b'BELOTE-TABLEBASE-1\n'
+'''Start of an endgame tablebase file'''
+TABLEBASE_HEADER = struct.Struct('<IBB')
+'''Tablebase header: the deck as a bitmask, most cards per player and the number of sections'''
+TABLEBASE_SECTION = struct.Struct('<BBQQQQ')
+'''Tablebase section of one trump and hand size: its positions and where its values, leaf offsets and leaves start'''
+TABLEBASE_LEAF = numpy.dtype([('points', '<i2'), ('count', '<u4')])
+'''Points a tablebase position can end on with the number of futures that end on them'''
+TABLEBASE_POSITIONS = 10 ** 7
+'''Most round starts build_tablebase solves unless told otherwise, all of them are held in memory until written'''
+
+def endgame_rank(deck, hands, size, strides):
+    '''
+    Returns the number of the round start with size cards in each of the hands, seats
+    from the leader on, as numbered by a DealIndex of the deck in card order
+    '''
+    index = 0
+    left = deck
+    for hand, stride in zip(hands, strides):
+        # lexicographic rank of the hand's positions among the cards left
+        n = bin(left).count('1')
+        rank = math.comb(n, size) - 1
+        picked = size
+        cards = hand
+        while cards:
+            card = cards & -cards
+            cards ^= card
+            rank -= math.comb(n - 1 - bin(left & (card - 1)).count('1'), picked)
+            picked -= 1
+        index += rank * stride
+        left &= ~hand
+    return index
+
+def solve_endgame(hands, trump, child):
+    '''
+    Returns the leaf points with their futures and the minimax points of a round start
+    with the leader at seat 0, from the leader's team side. child returns the same for
+    the hands left after a trick from its winner's seat, or None after the last trick
+    '''
+    leaves = {}
+    trick = [NO_CARD] * 4
+
+    def play(turn):
+        hand = hands[turn]
+        valid = valid_mask(hand, trump, trick, 0, turn, turn)
+        best = None
+        while valid:
+            card = valid & -valid
+            valid ^= card
+            hands[turn] = hand ^ card
+            trick[turn] = card.bit_length() - 1
+            if turn < 3:
+                value = play(turn + 1)
+            else:
+                total, winningidx = trick_winner(trump, 0, trick)
+                points = total if winningidx % 2 == 0 else -total
+                after = child(hands, winningidx)
+                if after is None:
+                    leaves[points] = leaves.get(points, 0) + 1
+                    value = points
+                else:
+                    # the winner leads the next round, flip to this side when it's the other team
+                    sign = -1 if winningidx % 2 else 1
+                    for leaf, count in after[0]:
+                        leaf = points + sign*leaf
+                        leaves[leaf] = leaves.get(leaf, 0) + count
+                    value = points + sign*after[1]
+            if best is None or (value > best if turn % 2 == 0 else value < best):
+                best = value
+        hands[turn] = hand
+        trick[turn] = NO_CARD
+        return best
+
+    value = play(0)
+    return tuple(leaves.items()), value
+
+_endgame_level = None
+'''Deck, trump, cards per player and the solved round starts with one card less in this worker process'''
+
+def _init_endgame_worker(deck, trump, size, previous):
+    global _endgame_level
+    _endgame_level = deck, trump, size, previous
+
+def _solve_endgame_chunk(start, stop):
+    '''Solves the round starts numbered start up to stop of the worker's hand size'''
+    deck, trump, size, previous = _endgame_level
+    codes = [code for code in range(len(CARD_NAMES)) if deck >> code & 1]
+    strides = DealIndex(codes, [size - 1] * 4).strides
+
+    def child(hands, winningidx):
+        if previous is None:
+            return None
+        return previous[endgame_rank(deck, hands[winningidx:] + hands[:winningidx], size - 1, strides)]
+
+    solved = []
+    for dealt in DealIndex(codes, [size] * 4).deals(start, stop):
+        solved.append(solve_endgame([sum(1 << card for card in hand) for hand in dealt], trump, child))
+    return solved
+
+def build_tablebase(path, deck, cards, trumps=SUITS, workers=1, max_positions=TABLEBASE_POSITIONS):
+    '''
+    Solves every round start of the deck with up to cards cards per player for each
+    trump and writes them to a tablebase file at path. Each hand size is solved from
+    the one below it, split across worker processes when workers is more than 1.
+    Refuses to build more than max_positions round starts
+    '''
+    # the search only looks endgames up before the last round, so hands of 1 card are never read
+    if not 2 <= cards <= len(deck) // 4:
+        raise ValueError(f'{len(deck)} cards can not deal {cards} cards to each player, at least 2 are needed')
+    mask = encode_hand(deck)
+    codes = [code for code in range(len(CARD_NAMES)) if mask >> code & 1]
+    positions = len(trumps) * sum(DealIndex(codes, [size] * 4).count for size in range(1, cards + 1))
+    if positions > max_positions:
+        raise ValueError(f'{len(codes)} cards with {cards} cards per player are {positions} round starts, '
+                         f'more than the {max_positions} allowed')
+    sections = []
+    for trump in trumps:
+        trump = encode_trump(trump)
+        previous = None
+        for size in range(1, cards + 1):
+            count = DealIndex(codes, [size] * 4).count
+            level = mask, trump, size, previous
+            if workers > 1:
+                shards = workers * 8
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_endgame_worker,
+                                         initargs=level) as pool:
+                    chunks = [pool.submit(_solve_endgame_chunk, count * shard // shards,
+                                          count * (shard + 1) // shards) for shard in range(shards)]
+                    previous = [entry for chunk in chunks for entry in chunk.result()]
+            else:
+                _init_endgame_worker(*level)
+                previous = _solve_endgame_chunk(0, count)
+            sections.append((trump, size, previous))
+    with open(path, 'wb') as f:
+        f.write(TABLEBASE_MAGIC)
+        f.write(TABLEBASE_HEADER.pack(mask, cards, len(sections)))
+        table_at = f.tell()
+        f.write(bytes(TABLEBASE_SECTION.size * len(sections)))
+        table = []
+        for trump, size, solved in sections:
+            offsets = numpy.zeros(len(solved) + 1, '<u8')
+            offsets[1:] = numpy.cumsum([len(leaves) for leaves, _ in solved])
+            arrays = (numpy.array([value for _, value in solved], '<i2'), offsets,
+                      numpy.array([leaf for leaves, _ in solved for leaf in leaves], TABLEBASE_LEAF))
+            starts = []
+            for array in arrays:
+                # keep every array aligned for the memory map
+                f.write(bytes(-f.tell() % 8))
+                starts.append(f.tell())
+                f.write(array.tobytes())
+            table.append(TABLEBASE_SECTION.pack(trump, size, len(solved), *starts))
+        f.seek(table_at)
+        f.write(b''.join(table))
+
+class Tablebase:
+    '''
+    Endgames solved ahead of time by build_tablebase, read from a memory mapped file
+
+    Round starts are stored with the leader at seat 0, any other leader is turned
+    around to it. Only the path is pickled, so worker processes map the same file
+    read only instead of copying it
+    '''
+    def __init__(self, path):
+        self.path = path
+        '''Tablebase file'''
+        self.map = None
+        '''Read only memory map of the file'''
+        self.deck = 0
+        '''Bitmask of the cards the tablebase was built for'''
+        self.cards = 0
+        '''Most cards per player of a stored round start'''
+        self.sections = {}
+        '''Encoded trump and cards per player to the values, leaf offsets, leaves and strides of the section'''
+        self.hits = 0
+        '''Tracks how many lookups were found'''
+        self.misses = 0
+        '''Tracks how many lookups were not found'''
+        self.open()
+
+    def open(self):
+        with open(self.path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(TABLEBASE_MAGIC)] != TABLEBASE_MAGIC:
+            self.map.close()
+            raise ValueError(f'{self.path} is not a belote tablebase file')
+        self.deck, self.cards, count = TABLEBASE_HEADER.unpack_from(self.map, len(TABLEBASE_MAGIC))
+        codes = [code for code in range(len(CARD_NAMES)) if self.deck >> code & 1]
+        self.sections = {}
+        at = len(TABLEBASE_MAGIC) + TABLEBASE_HEADER.size
+        for _ in range(count):
+            trump, size, positions, values, offsets, leaves = TABLEBASE_SECTION.unpack_from(self.map, at)
+            at += TABLEBASE_SECTION.size
+            offsets = numpy.frombuffer(self.map, '<u8', positions + 1, offsets)
+            self.sections[trump, size] = (numpy.frombuffer(self.map, '<i2', positions, values), offsets,
+                                          numpy.frombuffer(self.map, TABLEBASE_LEAF, int(offsets[-1]), leaves),
+                                          DealIndex(codes, [size] * 4).strides)
+
+    def close(self):
+        # the arrays point into the map, they go first
+        self.sections = {}
+        self.map.close()
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def find(self, hands, curr_turn, trump):
+        '''Returns the section and number of a round start, None when it isn't stored'''
+        size = bin(hands[curr_turn]).count('1')
+        section = self.sections.get((trump, size))
+        if section is None or (hands[0] | hands[1] | hands[2] | hands[3]) & ~self.deck:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return section, endgame_rank(self.deck, hands[curr_turn:] + hands[:curr_turn], size, section[3])
+
+    def leaves(self, hands, curr_turn, trump):
+        '''Returns the (points, count) leaf totals of a round start from team A's side like a transposition entry'''
+        found = self.find(hands, curr_turn, trump)
+        if found is None:
+            return None
+        (_, offsets, leaves, _), ix = found
+        entry = leaves[offsets[ix]:offsets[ix + 1]].tolist()
+        if curr_turn % 2:
+            return [(-leaf, count) for leaf, count in entry]
+        return entry
+
+    def value(self, hands, curr_turn, trump):
+        '''Returns the minimax points of a round start for team A, None when it isn't stored'''
+        found = self.find(hands, curr_turn, trump)
+        if found is None:
+            return None
+        (values, _, _, _), ix = found
+        value = int(values[ix])
+        return -value if curr_turn % 2 else value
+
+CARD_SUIT_ARRAY = numpy.array(CARD_SUIT + [NO_TRUMP])
+'''Encoded suit per table slot, NO_CARD has no suit'''
+SUIT_MASK_ARRAY = numpy.array(SUIT_MASKS, numpy.int64)
+'''Bitmask of every card in a suit as an array'''
+HIGHER_MASK_ARRAYS = [numpy.array(masks + [0], numpy.int64) for masks in HIGHER_MASKS]
+'''Bitmask of same suit cards worth more per table slot, indexed by encoded trump'''
+CARD_BITS = numpy.arange(len(CARD_NAMES), dtype=numpy.int64)
+'''Bit of each encoded card'''
+
+def valid_masks(hands, trump, trick, lead_pos, turn, card_played):
+    '''Same as valid_mask for arrays of hands, tricks, lead positions and turns'''
+    if card_played == 0:
+        return hands
+    rows = numpy.arange(len(hands))
+    lead_suit = CARD_SUIT_ARRAY[trick[rows, lead_pos]]
+    follow = hands & SUIT_MASK_ARRAY[lead_suit]
+    _, wi = resolve_tricks(trump, lead_pos, trick)
+    winning = trick[rows, wi]
+    higher = HIGHER_MASK_ARRAYS[trump][winning]
+    # can follow suit trump - need to play higher
+    follow_higher = follow & higher
+    if trump != NO_TRUMP:
+        follow = numpy.where((lead_suit == trump) & (follow_higher != 0), follow_higher, follow)
+    # can't follow suit - cut with a higher trump if trump has been played
+    trumps = hands & SUIT_MASKS[trump]
+    trumps_higher = trumps & higher
+    cut = numpy.where((CARD_SUIT_ARRAY[winning] == trump) & (trumps_higher != 0), trumps_higher, trumps)
+    # partner is winning or can't cut - throw off
+    cut = numpy.where((wi == (turn + 2) % 4) | (trumps == 0), hands, cut)
+    return numpy.where(follow != 0, follow, cut)
+
+class BatchState:
+    '''Futures advanced together as arrays, one row per future'''
+    def __init__(self, hands, trick, turn, lead_pos, points, key):
+        self.hands = hands
+        '''Hand bitmask per player'''
+        self.trick = trick
+        '''Table slots for the current round'''
+        self.turn = turn
+        '''Player to play next'''
+        self.lead_pos = lead_pos
+        '''Position of the lead card'''
+        self.points = points
+        '''Points so far for the current player's team'''
+        self.key = key
+        '''Which deal, and later which card of the current player, the future belongs to'''
+        self.deal = None
+        '''Set to key while the futures have not played the current player's card yet'''
+
+    def play(self, trump, card_played):
+        '''Returns a future for every valid card the next player can play in every row'''
+        rows = numpy.arange(len(self.key))
+        valid = valid_masks(self.hands[rows, self.turn], trump, self.trick, self.lead_pos,
+                            self.turn, card_played)
+        parent, card = numpy.nonzero(valid[:, None] >> CARD_BITS & 1)
+        turn = self.turn[parent]
+        rows = numpy.arange(len(parent))
+        hands = self.hands[parent]
+        hands[rows, turn] ^= numpy.int64(1) << card
+        trick = self.trick[parent]
+        trick[rows, turn] = card
+        lead_pos = turn if card_played == 0 else self.lead_pos[parent]
+        return BatchState(hands, trick, (turn + 1) % 4, lead_pos, self.points[parent], self.key[parent])
+
+    def solve(self, trump, team):
+        '''Solves the full round in every row and starts the next one at the winner'''
+        totals, winners = resolve_tricks(trump, self.lead_pos, self.trick)
+        totals = totals.astype(numpy.int64)
+        self.points = self.points + numpy.where(winners % 2 == team, totals, -totals)
+        self.turn = winners.astype(numpy.int64)
+        self.trick = numpy.full_like(self.trick, NO_CARD)
+
+    def split(self, size):
+        '''Returns the rows in batches of at most size futures'''
+        for start in range(0, len(self.key), size):
+            end = start + size
+            yield BatchState(self.hands[start:end], self.trick[start:end], self.turn[start:end],
+                             self.lead_pos[start:end], self.points[start:end], self.key[start:end])
+
+def add_deal_moments(deal_moments, card, stratum, total, futures):
+    '''Adds one deal's futures for a card into the per stratum sums used for standard errors'''
+    moments = deal_moments.setdefault(card, {}).setdefault(stratum, [0, 0, 0, 0, 0, 0])
+    moments[0] += 1
+    moments[1] += total
+    moments[2] += futures
+    moments[3] += total * total
+    moments[4] += total * futures
+    moments[5] += futures * futures
+
+def merge_deal_moments(deal_moments, other):
+    '''Adds the per stratum sums from other into deal_moments'''
+    for card, strata in other.items():
+        for stratum, moments in strata.items():
+            merged = deal_moments.setdefault(card, {}).setdefault(stratum, [0, 0, 0, 0, 0, 0])
+            for ix,value in enumerate(moments):
+                merged[ix] += value
+
+def ratio_standard_error(strata, weights):
+    '''
+    Returns the standard error of the average points of a card from sampled deals
+
+    The average is the points over the futures of every deal sampled, so this is
+    the standard error of a ratio estimate, combined over strata by their weights,
+    or by their share of the deals sampled when weights is None
+    '''
+    deals = sum(moments[0] for moments in strata.values())
+    futures = sum(moments[2] for moments in strata.values())
+    if deals < 2 or not futures:
+        return 0.0
+    if weights is None:
+        weights = {stratum: moments[0] / deals for stratum, moments in strata.items()}
+    ratio = sum(moments[1] for moments in strata.values()) / futures
+    variance = 0.0
+    mean_futures = 0.0
+    for stratum, (count, total, fut, total2, cross, fut2) in strata.items():
+        mean_futures += weights[stratum] * fut / count
+        if count < 2:
+            continue
+        residual = total - ratio*fut
+        residual2 = total2 - 2*ratio*cross + ratio*ratio*fut2
+        variance += weights[stratum]**2 * (residual2 - residual*residual/count) / (count - 1) / count
+    return math.sqrt(max(variance, 0.0)) / mean_futures
+
+_worker_game = None
+'''Game used by this worker process'''
+_worker_position = None
+'''Encoded position searched by this worker process'''
+
+def _init_worker(game, position):
+    global _worker_game, _worker_position
+    _worker_game = game
+    _worker_position = position
+
+def _search_chunk(deals, node_budget=None):
+    '''
+    Searches a chunk of deals in a worker, returns the futures summed up per card,
+    the per stratum sums of the deals when sampling and how far the budget let it get
+    '''
+    curr_turn, lead_pos, trump, table, hand, valid_cards, sampling = _worker_position
+    card_stats = {card: _worker_game.new_aggregate() for card in valid_cards}
+    deal_moments = {} if sampling else None
+    _worker_game.node_budget = node_budget
+    _worker_game.reset_budget()
+    if _worker_game.stats is not None:
+        _worker_game.stats = SearchStats()
+    _worker_game.search_deals(deals, curr_turn, lead_pos, trump, table, hand, valid_cards,
+                              card_stats, deal_moments)
+    return (card_stats, deal_moments, _worker_game.deals_searched, _worker_game.nodes,
+            _worker_game.out_of_budget, _worker_game.stats)
+
 class Game:
     def __init__(self):
         self.lead = ''
@@ -86,79 +1294,102 @@ class Game:
         '''List of cards that have been played'''
         self.print_level = PrintLevel.ERROR
         '''Log level for messages'''
+        self.search_mode = SearchMode.AVERAGE
+        '''How futures are scored per card'''
+        self.workers = 1
+        '''Processes searching deals, 1 searches in this process'''
+        self.chunk_size = 64
+        '''Deals sent to a worker process at a time'''
+        self.batch_size = 0
+        '''Deals searched together as arrays, 0 searches one deal at a time'''
+        self.batch_states = 1 << 16
+        '''Most futures advanced together as arrays in a batch'''
+        self.samples = 0
+        '''Random deals searched per turn, 0 searches every possible deal'''
+        self.seed = None
+        '''Seed for the random deals, None picks a new one every search'''
+        self.stratified = False
+        '''Sample deals in proportion to the ways the unseen trumps can be split'''
+        self.standard_errors = {}
+        '''Standard error of the points per card from the last sampled search'''
+        self.canonical_deals = True
+        '''Search one deal per class of deals that play out the same and weight it'''
+        self.infer_voids = True
+        '''Only deal hands that could have played the cards on the table by the rules'''
+        self.histogram_bins = 0
+        '''Bins of the points histogram kept per card, 0 keeps no histogram'''
+        self.keep_leaves = False
+        '''Keep the points of every future per card to debug a search, uses a lot of memory'''
+        self.time_budget = None
+        '''Seconds a search may take before it answers with the deals done, None has no limit'''
+        self.node_budget = None
+        '''Cards played in futures a search may take, None has no limit'''
+        self.deadline = None
+        '''time.monotonic() the running search has to stop by'''
+        self.nodes = 0
+        '''Cards played in futures by the last search'''
+        self.deals_searched = 0
+        '''Deals fully searched by the last search, counting the deals a class stands for'''
+        self.coverage = 1.0
+        '''Share of the possible (or sampled) deals the last search got through'''
+        self.out_of_budget = False
+        '''True when the last search stopped on its budget'''
+        self.next_budget_check = math.inf
+        '''Nodes the running search reaches before it checks the budget again'''
+        self.collect_stats = False
+        '''Collect SearchStats on every search, search_futures can also ask for them'''
+        self.stats = None
+        '''SearchStats of the last search, None when they were not collected'''
+        self.trace = None
+        '''TraceRecorder solved sets are recorded into, None records none unless unit testing'''
+        self.hooks = []
+        '''Callables called as hook(event, game) with a HookEvent in this process, for sampling profilers'''
         self.errors = 0
         '''Tracks how many errors occured'''
+        self.decisions = []
+        '''Cards picked by play() with the round, player, average points per card and search seconds'''
+        self.frames = [[0] * 32 for _ in range(13)]
+        '''Frame stack reused by every calculate, one entry per card left in the game'''
+        self.transposition = TranspositionTable(1 << 20)
+        '''Solved positions reused across searches, max_entries 0 disables it'''
+        self.group_equal_cards = True
+        '''Search one of the same suit cards worth the same points a player can play and count it for each'''
+        self.deal_range = None
+        '''Start and stop of the only deals searched as numbered by the DealIndex of the turn, None searches every deal'''
+        self.drop_played = True
+        '''play() drops the solved positions each card it plays rules out, keeping those the next turns reach'''
+        self.tablebase = None
+        '''Tablebase the endgames it stores are looked up in instead of searched, None searches them'''
 
         # unit testing #
         self.unit_testing = False
         '''True will record sets, False will not'''
-        self.check_sets = []
-        '''Where to record solved sets'''
 
-    def addCheckSet(self, cardset):
-        '''For unit testing, record all sets solved during calculations'''
-        if self.unit_testing:
-            self.check_sets.append(list(cardset))
+    @property
+    def check_sets(self):
+        '''Sets recorded in the trace as the cards on the table, oldest first'''
+        return [] if self.trace is None else [cards for cards, _, _, _ in self.trace.sets()]
+
+    def addCheckSet(self, trick, lead_pos, total, winningidx):
+        '''Records an encoded set solved during calculations, for unit testing or replay'''
+        if self.trace is None:
+            self.trace = TraceRecorder()
+        self.trace.record(trick, lead_pos, winningidx, total)
 
     def get_valid_set(self, cards, lead, trump, table, turn, card_played):
         if card_played == 0:
             return cards
-        partner_played = ''
-        if turn == 0:
-            partner_played = table[2]
-        elif turn == 1:
-            partner_played = table[3]
-        elif turn == 2:
-            partner_played = table[0]
-        elif turn == 3:
-            partner_played = table[1]
-        else:
+        if turn < 0 or turn > 3:
             self.print(f'Sent invalid turn -> {turn}', print_level=PrintLevel.ERROR)
             return cards
-        suits = [get_card_suit(card) for card in cards]
-        valid = []
-        lead_suit = get_card_suit(lead)
-        # can follow suit
-        if lead_suit in suits:
-            # can follow suit trump - need to play higher
-            if lead_suit == trump:
-                tp, wi = self.solveSet(trump, lead, table)
-                for ix,suit in enumerate(suits):
-                    if suit == lead_suit and cardPoints(cards[ix],trump) > cardPoints(table[wi],trump):
-                        valid.append(cards[ix])
-                # nothing higher
-                if not valid:
-                    valid = [cards[ix] for ix,suit in enumerate(suits) if suit == lead_suit]
-            # can follow suit - not trump
-            else:
-                valid = [cards[ix] for ix,suit in enumerate(suits) if suit == lead_suit]
-        else:
-            # can't follow suit
-            # check partner is winning
-            tp, wi = self.solveSet(trump, lead, table)
-            # partner is winning - no need to play trump
-            if table[wi] == partner_played:
-                valid = cards
-            # partner is not winning need to cut - play trump
-            elif trump in suits:
-                # check if trump has already been played
-                suits_table = [get_card_suit(card) for card in table]
-                # trump has been played - must play higher
-                if trump in suits_table:
-                    tp, wi = self.solveSet(trump, lead, table)
-                    for ix,suit in enumerate(suits):
-                        if suit == trump and cardPoints(cards[ix],trump) > cardPoints(table[wi],trump):
-                            valid.append(cards[ix])
-                    # nothing higher - play any trump
-                    if not valid:
-                        valid = [cards[ix] for ix,suit in enumerate(suits) if suit == trump]
-                # trump not played - play any trump
-                else:
-                    valid = [cards[ix] for ix,suit in enumerate(suits) if suit == trump]
-            # can't follow suit and can't cut - throw off
-            else:
-                valid = cards
-        return valid
+        trick = [encode_card(card) for card in table]
+        lead_code = encode_card(lead)
+        if lead_code == NO_CARD or lead_code not in trick:
+            self.print(f'Lead card {lead} is not in {table}', print_level=PrintLevel.ERROR)
+            return cards
+        valid = valid_mask(encode_hand(cards), encode_trump(trump), trick,
+                           trick.index(lead_code), turn, card_played)
+        return [card for card in cards if valid >> CARD_CODES[card] & 1]
 
     def solveSet(self, trump, lead, cards) -> tuple[list[int],int]:
         '''
@@ -168,51 +1399,32 @@ class Game:
         if not lead:
             self.print(f'Lead card is empty!', print_level=PrintLevel.ERROR)
             return [0,0], -1
-        totalPoints = 0
-        for card in cards:
-            if card:
-                totalPoints += cardPoints(card, trump)
         if not lead in cards:
             self.print(f'Lead card {lead} is not in {cards}', print_level=PrintLevel.ERROR)
             return [0,0],-1
-        leadidx = cards.index(lead)
-        cardtobeat = lead
-        for i in range(len(cards)):
-            idx = (leadidx + i) % len(cards)
-            if cards[idx] == cardtobeat:
-                continue
-            if cards[idx] == '':
-                continue
-            # current card is trump
-            if cards[idx][-1] == trump: 
-                # card to beat is also trump
-                if cardtobeat[-1] == trump:
-                    if cardPoints(cards[idx], trump) > cardPoints(cardtobeat, trump):
-                        cardtobeat = cards[idx]
-                # card to beat is not trump
-                else:
-                    cardtobeat = cards[idx]
-            else:
-                # current card is not trump and card to beat is not trump
-                if cardtobeat[-1] != trump:
-                    # check if matches lead
-                    # check if higher points
-                    if (lead[-1] == cards[idx][-1] and
-                        cardPoints(cards[idx], trump) > cardPoints(cardtobeat, trump)):
-                        cardtobeat = cards[idx]
-        winningidx = cards.index(cardtobeat)
+        if self.hooks:
+            self.call_hooks(HookEvent.SOLVE_SET_START)
+        totalPoints, winningidx = trick_winner(encode_trump(trump), cards.index(lead),
+                                               [encode_card(card) for card in cards])
+        if self.hooks:
+            self.call_hooks(HookEvent.SOLVE_SET_END)
         teamPoints = [totalPoints, totalPoints]
-        if cardtobeat == cards[0] or cardtobeat == cards[2]:
+        if winningidx % 2 == 0:
             teamPoints[1] = -1*totalPoints
         else:
             teamPoints[0] = -1*totalPoints
-        self.print(f'Solving: {cards} {teamPoints} lead:{lead} trump:{trump} winner:{winningidx}'
+        self.print(lambda: f'Solving: {cards} {teamPoints} lead:{lead} trump:{trump} winner:{winningidx}'
                    , print_level=PrintLevel.EXTRA_INFO)
         return teamPoints, winningidx
 
     def print(self, msg, print_level: PrintLevel=PrintLevel.ERROR, newline=True):
-        '''Utility print with different log levels'''
+        '''
+        Utility print with different log levels, msg can be a function returning
+        the message so it is only formatted when it is printed
+        '''
         if print_level <= self.print_level:
+            if callable(msg):
+                msg = msg()
             if print_level == PrintLevel.ERROR:
                 msg = 'ERROR: ' + msg
                 self.errors += 1
@@ -223,40 +1435,282 @@ class Game:
             else:
                 print(msg)
 
-    def calculate(self, players, curr_turn, card_played, lead, trump, round, table, points, card_points, team):
-        '''Run through all combinations with the players and their current hands'''
-        if curr_turn < 0 or curr_turn >= len(players):
+    def call_hooks(self, event):
+        for hook in self.hooks:
+            hook(event, self)
+
+    def new_aggregate(self):
+        '''Returns an empty summary of a card's futures with the histogram and leaves asked for'''
+        return PointsAggregate(self.histogram_bins, self.keep_leaves)
+
+    def reset_budget(self):
+        '''Starts counting a search against the deadline and node budget'''
+        self.nodes = 0
+        self.deals_searched = 0
+        self.out_of_budget = False
+        self.next_budget_check = math.inf
+        if self.deadline is not None or self.node_budget is not None or self.hooks:
+            self.next_budget_check = 0
+
+    def check_budget(self):
+        '''Raises BudgetExceeded once the running search is out of time or nodes'''
+        if self.hooks:
+            self.call_hooks(HookEvent.BUDGET_CHECK)
+        interval = BUDGET_INTERVAL
+        if self.node_budget is not None:
+            if self.nodes >= self.node_budget:
+                raise BudgetExceeded
+            interval = min(interval, self.node_budget - self.nodes)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise BudgetExceeded
+        self.next_budget_check = self.nodes + interval
+
+    def calculate(self, hands, orders, curr_turn, card_played, lead_pos, trump, round, table, points, card_points, team):
+        '''
+        Run through all combinations with the players and their current hands
+
+        Hands are encoded bitmasks per player, orders are the encoded cards each
+        player was dealt so cards are always tried in hand order. Cards are played
+        and taken back on the shared hands and table, and each card played in the
+        future is a frame on an explicit stack instead of a recursive call. The futures
+        are counted into card_points, a dict of the points they end on to how many do
+        '''
+        if curr_turn < 0 or curr_turn >= len(hands):
             self.print(f'Invalid index into player list! -> {curr_turn}',
                        print_level=PrintLevel.ERROR)
-        curr_player = players[curr_turn]
-        #print(f'P{curr_player.id} r:{round} t:{curr_turn} p:{card_played} {curr_player.handrounds}')
-        # get valid cards to try
-        valid_cards = self.get_valid_set(curr_player.handrounds[round], lead, trump,
-                                         table.cards[round], curr_turn, card_played)
-        for cardtoplay in valid_cards:
-            if round + 1 < 8:
-                curr_player.handrounds[round+1] = copy.copy(curr_player.handrounds[round])
-                curr_player.handrounds[round+1].remove(cardtoplay)
-            if card_played == 0:
-                lead = cardtoplay
-            table.cards[round][curr_player.id-1] = cardtoplay
-            #print(table.cards)
-            next_turn = curr_turn + 1 if curr_turn + 1 < 4 else 0
-            next_played = card_played + 1
-            nextround = copy.copy(round)
-            if next_played > 3:
-                nextround = round + 1
-                next_played = 0
-                teampoints, winningidx = self.solveSet(trump, lead, table.cards[round])
-                self.addCheckSet(table.cards[round])
-                points[round] = teampoints[team]
+        use_table = self.transposition.max_entries > 0 and not self.unit_testing
+        tablebase = None if self.unit_testing else self.tablebase
+        endgame = 8 - tablebase.cards if tablebase is not None else 8
+        tracing = (self.unit_testing or self.trace is not None
+                   or self.print_level >= PrintLevel.EXTRA_INFO)
+        hooked = bool(self.hooks)
+        grouped_cards = GROUPED_CARDS[trump] if self.group_equal_cards and not self.unit_testing else 0
+        sign = -1 if team else 1
+        stats = self.stats
+        # one frame per card played from here to the end of the game
+        (turns, played, leads, rounds, frame_points, frame_hands, valids, tried, keys, frame_leaves,
+         groups, weights, targets) = self.frames
+        nodes = self.nodes
+        check_at = self.next_budget_check
+        d = -1
+        # futures are counted per points they end on, into the counts of the card being tried
+        target = card_points
+        while True:
+            # enter the frame for the next card played
+            key = entry = None
+            if card_played == 0 and round < 7:
+                if round >= endgame:
+                    # the rest of the game was solved ahead of time
+                    entry = tablebase.leaves(hands, curr_turn, trump)
+                if entry is None and use_table:
+                    # a round starting from the same hands and leader was already searched
+                    key = position_key(hands, curr_turn, trump)
+                    entry = self.transposition.get(key)
+                if entry is not None:
+                    for leaf, count in entry:
+                        leaf = points + sign*leaf
+                        target[leaf] = target.get(leaf, 0) + count
+            if entry is None:
+                nodes += 1
+                if nodes >= check_at:
+                    self.nodes = nodes
+                    self.check_budget()
+                    check_at = self.next_budget_check
+                d += 1
+                turns[d] = curr_turn
+                played[d] = card_played
+                rounds[d] = round
+                frame_points[d] = points
+                frame_hands[d] = hands[curr_turn]
+                keys[d] = key
+                # only a round start stored in the table needs its futures counted apart
+                frame_leaves[d] = {} if key is not None else target
+                # get valid cards to try
+                if stats is not None:
+                    started = time.perf_counter()
+                valids[d] = valid_mask(hands[curr_turn], trump, table[round], lead_pos,
+                                       curr_turn, card_played)
+                groups[d] = None
+                grouped = valids[d] & grouped_cards
+                if grouped & (grouped - 1):
+                    valids[d], groups[d] = equal_card_groups(valids[d], trump)
+                weights[d] = 1
+                if stats is not None:
+                    stats.add_node(round, card_played, valids[d], started)
+                leads[d] = curr_turn if card_played == 0 else lead_pos
+                tried[d] = 0
+            # play the next valid card of the top frame in hand order
+            while d >= 0:
+                if weights[d] > 1:
+                    # the cards the last card tried stands for lead to the same futures
+                    leaves = frame_leaves[d]
+                    for leaf, count in targets[d].items():
+                        leaves[leaf] = leaves.get(leaf, 0) + count * weights[d]
+                    weights[d] = 1
+                curr_turn = turns[d]
+                order = orders[curr_turn]
+                ix = tried[d]
+                valid = valids[d]
+                while ix < len(order) and not valid >> order[ix] & 1:
+                    ix += 1
+                round = rounds[d]
+                trick = table[round]
+                if ix == len(order):
+                    # undo the moves so siblings never see this branch
+                    hands[curr_turn] = frame_hands[d]
+                    trick[curr_turn] = NO_CARD
+                    if keys[d] is not None:
+                        leaves = frame_leaves[d]
+                        self.transposition.put(keys[d], tuple((sign*(leaf - frame_points[d]), count)
+                                                              for leaf, count in leaves.items()))
+                        parent = targets[d - 1] if d > 0 else card_points
+                        for leaf, count in leaves.items():
+                            parent[leaf] = parent.get(leaf, 0) + count
+                    d -= 1
+                    continue
+                tried[d] = ix + 1
+                cardtoplay = order[ix]
+                if groups[d] is not None:
+                    weights[d] = groups[d].get(cardtoplay, 1)
+                # a card standing for others counts its futures apart to add them once per card
+                targets[d] = target = {} if weights[d] > 1 else frame_leaves[d]
+                hands[curr_turn] = frame_hands[d] ^ (1 << cardtoplay)
+                trick[curr_turn] = cardtoplay
+                lead_pos = leads[d]
+                points = frame_points[d]
+                card_played = played[d] + 1
+                if card_played < 4:
+                    curr_turn = curr_turn + 1 if curr_turn + 1 < 4 else 0
+                    break
+                card_played = 0
+                if stats is not None:
+                    started = time.perf_counter()
+                if hooked:
+                    self.call_hooks(HookEvent.SOLVE_SET_START)
+                total, winningidx = trick_winner(trump, lead_pos, trick)
+                if hooked:
+                    self.call_hooks(HookEvent.SOLVE_SET_END)
+                if stats is not None:
+                    stats.add_trick(started)
+                if tracing:
+                    self.traceSet(trick, trump, lead_pos, total, winningidx)
+                points += total if winningidx % 2 == team else -total
                 if round >= 7:
-                    card_points.append(sum(points))
+                    target[points] = target.get(points, 0) + 1
                     continue
-                else:
-                    next_turn = winningidx
-                    self.print(f'-Round {nextround}-', print_level=PrintLevel.EXTRA_INFO)
-            self.calculate(players, next_turn, next_played, lead, trump, nextround, table, points, card_points, team)
+                curr_turn = winningidx
+                round += 1
+                if tracing:
+                    self.print(lambda: f'-Round {round}-', print_level=PrintLevel.EXTRA_INFO)
+                break
+            else:
+                self.nodes = nodes
+                return
+
+    def minimax(self, hands, orders, curr_turn, card_played, lead_pos, trump, round, table, points, alpha, beta, team):
+        '''
+        Returns the points for the team when both teams play their best cards,
+        cutting off futures that can't change the outcome (alpha-beta)
+        '''
+        self.nodes += 1
+        if self.nodes >= self.next_budget_check:
+            self.check_budget()
+        stored = False
+        if card_played == 0:
+            lead_pos = curr_turn
+            # best and worst case is winning or losing every point left
+            remaining = mask_points(trump, hands[0] | hands[1] | hands[2] | hands[3])
+            if points + remaining <= alpha:
+                return points + remaining
+            if points - remaining >= beta:
+                return points - remaining
+            if self.tablebase is not None and not self.unit_testing and 7 > round >= 8 - self.tablebase.cards:
+                value = self.tablebase.value(hands, curr_turn, trump)
+                if value is not None:
+                    return points + (value if team == 0 else -value)
+            # a round starting from the same hands and leader was already searched
+            stored = round < 7 and self.transposition.max_entries > 0 and not self.unit_testing
+            if stored:
+                key = position_key(hands, curr_turn, trump) | MINIMAX_KEY
+                entry = self.transposition.get(key)
+                lower, upper = -MAX_POINTS, MAX_POINTS
+                if entry is not None:
+                    lower, upper = entry if team == 0 else (-entry[1], -entry[0])
+                    if lower == upper or points + lower >= beta:
+                        return points + lower
+                    if points + upper <= alpha:
+                        return points + upper
+        hand = hands[curr_turn]
+        trick = table[round]
+        stats = self.stats
+        if stats is not None:
+            started = time.perf_counter()
+        valid = valid_mask(hand, trump, trick, lead_pos, curr_turn, card_played)
+        grouped = valid & GROUPED_CARDS[trump]
+        if grouped & (grouped - 1) and self.group_equal_cards and not self.unit_testing:
+            # cards that play out alike get the same points
+            valid = equal_card_groups(valid, trump)[0]
+        if stats is not None:
+            stats.add_node(round, card_played, valid, started)
+        # try the cards worth the most first, they decide the round and cut off the most
+        valid_cards = [card for card in orders[curr_turn] if valid >> card & 1]
+        valid_cards.sort(key=CARD_POINTS[trump].__getitem__, reverse=True)
+        maximizing = curr_turn % 2 == team
+        best = -MAX_POINTS if maximizing else MAX_POINTS
+        window = alpha, beta
+        for cardtoplay in valid_cards:
+            hands[curr_turn] = hand ^ (1 << cardtoplay)
+            trick[curr_turn] = cardtoplay
+            if card_played == 3:
+                if stats is not None:
+                    started = time.perf_counter()
+                if self.hooks:
+                    self.call_hooks(HookEvent.SOLVE_SET_START)
+                total, winningidx = trick_winner(trump, lead_pos, trick)
+                if self.hooks:
+                    self.call_hooks(HookEvent.SOLVE_SET_END)
+                if stats is not None:
+                    stats.add_trick(started)
+                self.traceSet(trick, trump, lead_pos, total, winningidx)
+                value = points + (total if winningidx % 2 == team else -total)
+                if round < 7:
+                    value = self.minimax(hands, orders, winningidx, 0, lead_pos, trump, round + 1,
+                                         table, value, alpha, beta, team)
+            else:
+                next_turn = curr_turn + 1 if curr_turn + 1 < 4 else 0
+                value = self.minimax(hands, orders, next_turn, card_played + 1, lead_pos, trump,
+                                     round, table, points, alpha, beta, team)
+            if maximizing:
+                if value > best:
+                    best = value
+                    alpha = max(alpha, best)
+            elif value < best:
+                best = value
+                beta = min(beta, best)
+            if alpha >= beta:
+                break
+        hands[curr_turn] = hand
+        trick[curr_turn] = NO_CARD
+        if stored:
+            # outside the window the result is only a bound on the real points
+            if best <= window[0]:
+                upper = min(upper, best - points)
+            elif best >= window[1]:
+                lower = max(lower, best - points)
+            else:
+                lower = upper = best - points
+            self.transposition.put(key, (lower, upper) if team == 0 else (-upper, -lower))
+        return best
+
+    def traceSet(self, trick, trump, lead_pos, total, winningidx):
+        '''Records and logs an encoded set solved during calculations'''
+        if self.trace is not None or self.unit_testing:
+            self.addCheckSet(trick, lead_pos, total, winningidx)
+        if self.print_level >= PrintLevel.EXTRA_INFO:
+            cards = [decode_card(card) for card in trick]
+            teamPoints = [total, -total] if winningidx % 2 == 0 else [-total, total]
+            self.print(f'Solving: {cards} {teamPoints} lead:{cards[lead_pos]} ' \
+                       f'trump:{self.trump} winner:{winningidx}', print_level=PrintLevel.EXTRA_INFO)
 
     def get_hand_sizes(self, start_turn, start_played, start_round):
         '''Returns the correct hand sizes each player needs at this turn and round'''
@@ -273,103 +1727,637 @@ class Game:
                 rounds[start_turn] = start_round
         return hand_sizes, rounds
 
-    def get_all_hands(self, hand_sizes, deck_played):
-        '''Returns a random unique hand per player'''
+    def get_all_hands(self, hand_sizes, deck_played, excluded=None):
+        '''Returns a random unique hand per player, holding none of the cards excluded per player'''
         if sum(hand_sizes) > len(self.fulldeck):
             print(f'Not enough cards in deck to distribute! {hand_sizes} {self.fulldeck}')
             return None
-        deck = [c for c in self.fulldeck if c not in deck_played]
-        for hand1 in itertools.combinations(deck, hand_sizes[0]):
-            remaining1 = set(deck) - set(hand1)
-            for hand2 in itertools.combinations(sorted(remaining1), hand_sizes[1]):
-                remaining2 = remaining1 - set(hand2)
-                for hand3 in itertools.combinations(sorted(remaining2), hand_sizes[2]):
-                    remaining3 = remaining2 - set(hand3)
-                    for hand4 in itertools.combinations(sorted(remaining3), hand_sizes[3]):
-                        yield [hand1, hand2, hand3, hand4]
+        yield from self.get_deal_index(hand_sizes, deck_played, excluded).deals()
+
+    def get_deal_index(self, hand_sizes, deck_played, excluded=None):
+        '''Returns the DealIndex of every deal of the cards not played into hands of hand_sizes'''
+        return DealIndex([c for c in self.fulldeck if c not in deck_played], hand_sizes, excluded)
+
+    def get_turn_deals(self, deck_played):
+        '''
+        Returns the cards each player holds, the cards each player can't hold and the
+        DealIndex of the deals of the turn, with the cards in deck_played out of the deck
+        '''
+        hand_sizes, _ = self.get_hand_sizes(self.curr_turn, self.card_played, self.round)
+        excluded = None
+        if self.infer_voids and not self.unit_testing:
+            # rule out the cards each player showed they don't hold
+            excluded = self.get_excluded_cards([c for c in self.fulldeck if c not in deck_played])
+        deal_index = self.get_deal_index(hand_sizes, deck_played, excluded)
+        if deal_index.count == 0 and excluded and any(excluded):
+            self.print(f'No deal fits the cards played on {self.table.cards}, dealing every card',
+                       print_level=PrintLevel.WARNING)
+            excluded = None
+            deal_index = self.get_deal_index(hand_sizes, deck_played)
+        return hand_sizes, excluded, deal_index
+
+    def get_excluded_cards(self, deck):
+        '''
+        Returns the cards of the deck each player can't hold, because holding one
+        would have made a card they already played against the rules
+
+        A played card is only ever ruled out by a single other card in the hand
+        (one of the lead suit, a trump or a higher trump), so each unseen card is
+        checked on its own with the played card. Rounds without a known lead are skipped
+        '''
+        trump = encode_trump(self.trump)
+        unseen = encode_hand(deck)
+        excluded = [0, 0, 0, 0]
+        for round in range(min(self.round, 7) + 1):
+            lead = self.lead if round == self.round else self.table.leads[round]
+            cards = self.table.cards[round]
+            if not lead or lead not in cards:
+                continue
+            played = [encode_card(card) for card in cards]
+            lead_pos = played.index(CARD_CODES[lead])
+            trick = [NO_CARD] * 4
+            for card_played in range(4):
+                turn = (lead_pos + card_played) & 3
+                card = played[turn]
+                if card == NO_CARD:
+                    break
+                if card_played:
+                    others = unseen & ~excluded[turn]
+                    while others:
+                        other = others & -others
+                        others ^= other
+                        if not valid_mask(1 << card | other, trump, trick, lead_pos, turn,
+                                          card_played) >> card & 1:
+                            excluded[turn] |= other
+                trick[turn] = card
+        return [{CARD_NAMES[code] for code in range(len(CARD_NAMES)) if mask >> code & 1}
+                for mask in excluded]
     
-    def base_calculate(self, curr_player, card, newlead, newround, newplayers):
-        '''Sets up the calculations and points per card dictionary'''
-        card_points = [] # contains the points from the end of all calculations for this card
-        points = [0 for _ in range(8)] # save all the points per round this card gets
+    def get_suit_swaps(self, deck, curr_hand, trick, excluded=None):
+        '''
+        Returns every mapping of suits that leaves the position the same: non trump suits
+        not on the table where the current hand, the unseen deck and the cards each
+        player can't hold have the same ranks
+        '''
+        def ranks(cards, suit):
+            return tuple(sorted(card[:-1] for card in cards if get_card_suit(card) == suit))
+        classes = {}
+        for suit in SUITS:
+            if suit == self.trump or any(get_card_suit(card) == suit for card in trick):
+                continue
+            key = ranks(curr_hand, suit), ranks(deck, suit), tuple(ranks(cards, suit) for cards in excluded or [])
+            classes.setdefault(key, []).append(suit)
+        swaps = [{}]
+        for suits in classes.values():
+            swaps = [dict(swap, **dict(zip(suits, perm)))
+                     for swap in swaps for perm in itertools.permutations(suits)]
+        return swaps
+
+    def get_deal_classes(self, hand_sizes, deck_played, curr_hand, trick, excluded=None):
+        '''
+        Returns one deal per class of deals that play out the same, with the deals it stands for
+
+        Unseen cards of the same suit and points are interchangeable, so a class is how many
+        of each such group every player holds. Swapping suits that look the same to the
+        current player gives a class that plays out the same with the swapped cards.
+        Players never get cards of a group excluded for them
+        '''
+        deck = [c for c in self.fulldeck if c not in deck_played]
+        groups = {}
+        for card in deck:
+            # which players can hold the card, nobody can always hold the cards left over
+            allowed = tuple(card not in cards for cards in excluded or [()] * 4) + (True,)
+            groups.setdefault((get_card_suit(card), cardPoints(card, self.trump), allowed), []).append(card)
+        keys = list(groups)
+        key_index = {key: ix for ix,key in enumerate(keys)}
+        swaps = []
+        for swap in self.get_suit_swaps(deck, curr_hand, trick, excluded):
+            # position of each group after the swap and the card played instead
+            moved = [key_index[(swap.get(suit, suit), points, allowed)] for suit, points, allowed in keys]
+            card_map = {CARD_CODES[card]: CARD_CODES[card[:-1] + swap.get(suit, suit)]
+                        for card in curr_hand for suit in [get_card_suit(card)]}
+            swaps.append((moved, None if all(k == v for k,v in card_map.items()) else card_map))
+
+        def split(ix, left):
+            '''Every way to split the groups from ix onward between the hands left'''
+            if ix == len(keys):
+                yield ()
+                return
+            for counts in split_group(len(groups[keys[ix]]), left, 0, keys[ix][2]):
+                rest = [size - count for size, count in zip(left, counts)]
+                for tail in split(ix + 1, rest):
+                    yield (counts,) + tail
+
+        def split_group(size, left, player, allowed):
+            if player == len(left) - 1:
+                if size <= left[player]:
+                    yield (size,)
+                return
+            most = min(size, left[player]) if allowed[player] else 0
+            for count in range(most + 1):
+                for tail in split_group(size - count, left, player + 1, allowed):
+                    yield (count,) + tail
+
+        # cards left over when the deck holds more than the hands go to nobody
+        # ways to deal each group of cards with the counts per player
+        group_weights = {}
+        def group_weight(size, group_counts):
+            weight = group_weights.get(group_counts)
+            if weight is None:
+                weight = group_weights[group_counts] = math.factorial(size) // math.prod(
+                    math.factorial(count) for count in group_counts)
+            return weight
+
+        for counts in split(0, list(hand_sizes) + [len(deck) - sum(hand_sizes)]):
+            images = {counts: None}
+            for moved, card_map in swaps[1:]:
+                swapped = [None] * len(keys)
+                for ix,target in enumerate(moved):
+                    swapped[target] = counts[ix]
+                images.setdefault(tuple(swapped), card_map)
+            # the smallest class of the swapped ones searches for all of them
+            if len(images) > 1 and min(images) != counts:
+                continue
+            weight = 1
+            hands = [[], [], [], [], []]
+            for key, group_counts in zip(keys, counts):
+                cards = groups[key]
+                weight *= group_weight(len(cards), group_counts)
+                dealt = 0
+                for player, count in enumerate(group_counts):
+                    if count:
+                        hands[player].extend(cards[dealt:dealt + count])
+                        dealt += count
+            yield hands[:4], tuple((card_map, weight) for card_map in images.values())
+
+    def get_trump_splits(self, hand_sizes, deck):
+        '''Returns every way to split the trumps in the deck across the hands and how many deals have it'''
+        trumps = len([card for card in deck if get_card_suit(card) == self.trump])
+        others = len(deck) - trumps
+        splits = [((), 1, trumps, others)]
+        for size in hand_sizes:
+            next_splits = []
+            for split, count, trumps_left, others_left in splits:
+                for dealt in range(max(0, size - others_left), min(size, trumps_left) + 1):
+                    next_splits.append((split + (dealt,),
+                                        count * math.comb(trumps_left, dealt)
+                                              * math.comb(others_left, size - dealt),
+                                        trumps_left - dealt, others_left - size + dealt))
+            splits = next_splits
+        return [(split, count) for split, count, _, _ in splits]
+
+    def get_sampled_hands(self, hand_sizes, deck_played, samples, rng, splits=None):
+        '''
+        Returns random hands per player, drawn uniformly from every possible deal
+        or split between the trump splits given in proportion to their deals
+        '''
+        deck = [c for c in self.fulldeck if c not in deck_played]
+        order = {card: ix for ix,card in enumerate(deck)}
+        if not splits:
+            splits = [(None, samples)]
+        trumps = [card for card in deck if get_card_suit(card) == self.trump]
+        others = [card for card in deck if get_card_suit(card) != self.trump]
+        for split, count in splits:
+            for _ in range(count):
+                hands = []
+                if split is None:
+                    rng.shuffle(deck)
+                    dealt = 0
+                    for size in hand_sizes:
+                        hands.append(deck[dealt:dealt + size])
+                        dealt += size
+                else:
+                    rng.shuffle(trumps)
+                    rng.shuffle(others)
+                    dealt_trumps = dealt_others = 0
+                    for size, in_trump in zip(hand_sizes, split):
+                        hands.append(trumps[dealt_trumps:dealt_trumps + in_trump]
+                                     + others[dealt_others:dealt_others + size - in_trump])
+                        dealt_trumps += in_trump
+                        dealt_others += size - in_trump
+                yield [tuple(sorted(hand, key=order.__getitem__)) for hand in hands]
+
+    def allocate_samples(self, splits, samples):
+        '''Splits the samples between the trump splits in proportion to their deals'''
+        total = sum(count for _, count in splits)
+        shares = [samples * count / total for _, count in splits]
+        allocated = [int(share) for share in shares]
+        # hand out what is left to the largest remainders
+        by_remainder = sorted(range(len(splits)), key=lambda ix: shares[ix] - allocated[ix],
+                              reverse=True)
+        for ix in by_remainder[:samples - sum(allocated)]:
+            allocated[ix] += 1
+        return [(split, allocated[ix]) for ix,(split, _) in enumerate(splits) if allocated[ix]]
+
+    def base_calculate(self, curr_turn, card, lead_pos, hands, orders, table, trump):
+        '''Plays the candidate card and returns the points from all futures it leads to'''
+        card_points = {} # counts the futures of this card by the points they end on
+        points = 0 # save all the points this card gets
         # if this is the first card played this round, make it lead
         if self.card_played == 0:
-            newlead = copy.copy(card)
-        # generate a new table
-        newtable = Table()
-        newtable.cards = copy.deepcopy(self.table.cards)
+            lead_pos = curr_turn
         # try the card picked
-        newtable.cards[self.round][curr_player.id-1] = card
-        team = (curr_player.id-1) % 2 # find out which team this player is on
-        next_turn = self.curr_turn + 1 if self.curr_turn + 1 < 4 else 0
+        trick = table[self.round]
+        trick[curr_turn] = card
+        team = curr_turn % 2 # find out which team this player is on
+        next_turn = curr_turn + 1 if curr_turn + 1 < 4 else 0
         next_card = self.card_played + 1
+        newround = self.round
         # if this card played is the last of the round
         if next_card > 3:
             next_card = 0
             # solve the set since we are at the end of the round
-            teampoints, winningidx = self.solveSet(self.trump, newlead, newtable.cards[self.round])
-            self.addCheckSet(newtable.cards[self.round])
-            # add points for this round into the list
-            points[self.round] += teampoints[team]
+            if self.stats is not None:
+                started = time.perf_counter()
+            if self.hooks:
+                self.call_hooks(HookEvent.SOLVE_SET_START)
+            total, winningidx = trick_winner(trump, lead_pos, trick)
+            if self.hooks:
+                self.call_hooks(HookEvent.SOLVE_SET_END)
+            if self.stats is not None:
+                self.stats.add_trick(started)
+            self.traceSet(trick, trump, lead_pos, total, winningidx)
+            # add points for this round
+            points += total if winningidx % 2 == team else -total
             if self.round >= 7:
                 # if this is the last round and the last player
                 # no need to go through calculate()
                 # just sum the points so far and iterate to the next card
-                card_points.append(sum(points))
+                card_points[points] = 1
+                trick[curr_turn] = NO_CARD
                 return card_points
             # round is over, increment the round and start at the winning player
             next_turn = winningidx
             newround = self.round + 1
-            self.print(f'=Round {newround}=', print_level=PrintLevel.EXTRA_INFO)
-        if self.round + 1 < 8:
-            # if there is a next round
-            # add all cards except for the one we just played
-            # into the next hand for that round
-            newplayers[self.curr_turn].handrounds[self.round+1] = copy.copy(curr_player.handrounds[self.round])
-            newplayers[self.curr_turn].handrounds[self.round+1].remove(card)
-        #for p in newplayers:
-        #    print(f'check P{p.id} {p.handrounds}')
+            self.print(lambda: f'=Round {newround}=', print_level=PrintLevel.EXTRA_INFO)
+        # remove the card played from the hand for the next rounds
+        hand = hands[curr_turn]
+        hands[curr_turn] = hand ^ (1 << card)
         # run calculate
-        self.calculate(newplayers, next_turn, next_card, newlead, self.trump, newround, newtable, points, card_points, team)
+        if self.hooks:
+            self.call_hooks(HookEvent.CALCULATE_START)
+        try:
+            if self.search_mode == SearchMode.MINIMAX:
+                card_points[self.minimax(hands, orders, next_turn, next_card, lead_pos, trump, newround,
+                                         table, points, -MAX_POINTS, MAX_POINTS, team)] = 1
+            else:
+                self.calculate(hands, orders, next_turn, next_card, lead_pos, trump, newround, table,
+                               points, card_points, team)
+        finally:
+            if self.hooks:
+                self.call_hooks(HookEvent.CALCULATE_END)
+        hands[curr_turn] = hand
+        trick[curr_turn] = NO_CARD
         return card_points
 
-    def setup_calculate(self, curr_player, newlead, newround):
-        '''Generates possible hands for calculations'''
+    def setup_calculate(self, curr_player, newlead, newround, stats=None):
+        '''Generates possible hands for calculations, counting the search into stats if given'''
+        self.deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        self.reset_budget()
+        self.stats = stats
+        search_start = time.perf_counter()
 
         # check if player is valid
         if not curr_player.handrounds[self.round]:
             self.print(f'P{curr_player.id} has no cards {curr_player.handrounds}',
                        print_level=PrintLevel.ERROR)
 
-        # each card has a list to dump points from possible futures in
-        total_card_points = {card: [] for card in curr_player.handrounds[self.round]}
+        # each card sums up the points of its possible futures as they are found
+        total_card_points = {card: self.new_aggregate() for card in curr_player.handrounds[self.round]}
 
         # create the cards played deck with the current players hand
         deck_played = copy.copy(self.deck_played)
         deck_played.extend(curr_player.handrounds[self.round])
 
-        #print(f'base P{curr_player.id} {curr_player.handrounds}')
-        # create fake players to finish the game with
-        newplayers = [Player(p.id-1) for p in self.players]
+        # encode the position once, the search never sees strings
+        curr_turn = curr_player.id - 1
+        trump = encode_trump(self.trump)
+        table = [[NO_CARD]*4 for _ in range(8)]
+        table[self.round] = [encode_card(card) for card in self.table.cards[self.round]]
+        lead_pos = -1
+        if self.card_played > 0:
+            lead = encode_card(newlead)
+            if lead == NO_CARD or lead not in table[self.round]:
+                self.print(f'Lead card {newlead} is not in {self.table.cards[self.round]}',
+                           print_level=PrintLevel.ERROR)
+                return total_card_points
+            lead_pos = table[self.round].index(lead)
+        hand = tuple(encode_card(card) for card in curr_player.handrounds[self.round])
+
+        # filter out based on rules which cards are playable
+        valid = valid_mask(encode_hand(curr_player.handrounds[self.round]), trump,
+                           table[self.round], lead_pos, curr_turn, self.card_played)
+        valid_cards = [card for card in hand if valid >> card & 1]
 
         # create possible hands for other players
-        hand_sizes, rounds = self.get_hand_sizes(self.curr_turn, self.card_played, self.round)
-
-        for hands in self.get_all_hands(hand_sizes,deck_played):
-            # give each fake player their hand
-            for ix,hand in enumerate(hands):
-                newplayers[ix].handrounds[rounds[ix]] = list(hand)
-            # filter out based on rules which cards are playable
-            valid_cards = self.get_valid_set(curr_player.handrounds[self.round],
-                                             newlead, self.trump, self.table.cards[self.round],
-                                             self.curr_turn, self.card_played)
-            # test all cards in current player's hand
-            for card in valid_cards:
-                card_points = self.base_calculate(curr_player, card, newlead, newround,
-                                    newplayers)
-                total_card_points[card].extend(card_points)
+        hand_sizes, excluded, deal_index = self.get_turn_deals(deck_played)
+        deal_moments = None
+        total_deals = deal_index.count
+        if self.deal_range is not None:
+            # an exact shard of the deals, the other shards are searched elsewhere
+            all_hands = ((hands_dealt, SINGLE_DEAL) for hands_dealt in deal_index.deals(*self.deal_range))
+        elif self.samples > 0:
+            total_deals = self.samples
+            # sample random deals instead of every possible deal
+            splits = None
+            weights = {None: 1.0}
+            if deal_index.excluded is not None:
+                # trump splits don't count the excluded cards, draw from the deals left
+                # and weigh the strata by how many of the samples fall in them
+                rng = random.Random(self.seed)
+                order = {card: ix for ix,card in enumerate(self.fulldeck)}
+                all_hands = (([tuple(sorted(hand, key=order.__getitem__)) for hand in deal_index.sample(rng)],
+                              SINGLE_DEAL) for _ in range(self.samples))
+                weights = None
+            elif self.stratified:
+                deck = [c for c in self.fulldeck if c not in deck_played]
+                splits = self.allocate_samples(self.get_trump_splits(hand_sizes, deck), self.samples)
+                weights = {split: count / self.samples for split, count in splits}
+            if weights is not None:
+                all_hands = ((hands_dealt, SINGLE_DEAL) for hands_dealt in
+                             self.get_sampled_hands(hand_sizes, deck_played, self.samples,
+                                                    random.Random(self.seed), splits))
+            deal_moments = {}
+        elif self.time_budget is not None or self.node_budget is not None:
+            # the budget can stop the search part way, in deal order that would be a biased
+            # prefix of the deals, in random order the deals searched are a uniform sample
+            rng = random.Random(self.seed)
+            all_hands = ((deal_index.deal(index), SINGLE_DEAL) for index in deal_index.shuffled(rng))
+            weights = None
+            deal_moments = {}
+        elif self.canonical_deals and not self.unit_testing:
+            # only search one deal of each class of deals that play out the same
+            all_hands = self.get_deal_classes(hand_sizes, deck_played,
+                                              curr_player.handrounds[self.round],
+                                              self.table.cards[self.round], excluded)
+        else:
+            all_hands = ((hands_dealt, SINGLE_DEAL) for hands_dealt in deal_index.deals())
+        # the same hand shows up in many deals, only encode it once
+        encoded = {}
+        def encode(dealt):
+            codes = encoded.get(dealt)
+            if codes is None:
+                codes = encoded[dealt] = tuple(CARD_CODES[card] for card in dealt)
+            return codes
+        deals = (([encode(tuple(dealt)) for dealt in hands_dealt], images)
+                 for hands_dealt, images in all_hands)
+        if stats is not None:
+            deals = self.timed_deals(deals, stats)
+
+        if self.workers > 1 and not self.unit_testing:
+            card_stats = self.search_deals_parallel(deals, curr_turn, lead_pos, trump, table,
+                                                    hand, valid_cards, deal_moments)
+        else:
+            card_stats = {card: self.new_aggregate() for card in valid_cards}
+            self.search_deals(deals, curr_turn, lead_pos, trump, table, hand, valid_cards,
+                              card_stats, deal_moments)
+        for card, aggregate in card_stats.items():
+            total_card_points[CARD_NAMES[card]] = aggregate
+        self.coverage = self.deals_searched / total_deals if total_deals else 1.0
+        if stats is not None:
+            stats.search_time = time.perf_counter() - search_start
+        self.standard_errors = {}
+        if deal_moments is not None and (self.samples > 0 or self.out_of_budget):
+            self.standard_errors = {CARD_NAMES[card]: ratio_standard_error(strata, weights)
+                                    for card, strata in deal_moments.items()}
         return total_card_points
 
+    def timed_deals(self, deals, stats):
+        '''Yields the deals, counting them and the time taken to generate them into stats'''
+        deals = iter(deals)
+        while True:
+            started = time.perf_counter()
+            deal = next(deals, None)
+            stats.deal_time += time.perf_counter() - started
+            if deal is None:
+                return
+            stats.deals += 1
+            yield deal
+
+    def search_deals(self, deals, curr_turn, lead_pos, trump, table, hand, valid_cards, card_stats,
+                     deal_moments=None):
+        '''
+        Tests every valid card against each deal, adding the futures into card_stats
+        and the sums per trump split of each deal into deal_moments if given
+
+        Each deal comes with the deals it stands for, as the card the current player
+        would play there instead (None for the same card) and how many such deals there are.
+        A deal the budget runs out in is dropped whole, and under a budget setup_calculate
+        sends the deals in random order, so the deals searched are a uniform sample of them
+        '''
+        if self.batch_size > 0 and self.search_mode == SearchMode.AVERAGE and not self.unit_testing:
+            self.search_deals_batched(deals, curr_turn, lead_pos, trump, table, hand, valid_cards,
+                                      card_stats, deal_moments)
+            return
+        trump_mask = SUIT_MASKS[trump]
+        budgeted = self.next_budget_check != math.inf
+        hands = [0, 0, 0, 0]
+        orders = [(), (), (), ()]
+        for card in hand:
+            hands[curr_turn] |= 1 << card
+        orders[curr_turn] = hand
+        # cards that play out alike are searched once per deal and credited to each
+        searched_as = {card: card for card in valid_cards}
+        if self.group_equal_cards and not self.unit_testing:
+            for card in valid_cards:
+                searched_as[card] = next(other for other in valid_cards
+                                         if EQUAL_MASKS[trump][card] >> other & 1)
+        for hands_dealt, images in deals:
+            # give each fake player their hand, most deals only change the last hands
+            for ix,dealt in enumerate(hands_dealt):
+                if ix != curr_turn and dealt is not orders[ix]:
+                    orders[ix] = dealt
+                    hands[ix] = 0
+                    for card in dealt:
+                        hands[ix] |= 1 << card
+            stratum = None
+            if deal_moments is not None and self.stratified:
+                stratum = tuple(0 if ix == curr_turn else bin(hands[ix] & trump_mask).count('1')
+                                for ix in range(4))
+            if self.stats is not None:
+                self.stats.nodes[self.round*4 + self.card_played] += 1
+                self.stats.moves += len(valid_cards)
+            # test all cards in current player's hand
+            try:
+                if budgeted:
+                    self.check_budget()
+                searched = {}
+                for card in valid_cards:
+                    if searched_as[card] == card:
+                        searched[card] = self.base_calculate(curr_turn, card, lead_pos, hands, orders,
+                                                             table, trump)
+                results = [(card, searched[searched_as[card]]) for card in valid_cards]
+            except BudgetExceeded:
+                self.out_of_budget = True
+                return
+            for card, points in results:
+                # credit every deal this one stands for, with the card it plays there
+                for card_map, weight in images:
+                    card_stats[card_map[card] if card_map else card].add_leaves(points, weight)
+                if deal_moments is not None:
+                    add_deal_moments(deal_moments, card, stratum,
+                                     sum(leaf * count for leaf, count in points.items()), sum(points.values()))
+            self.deals_searched += sum(weight for _, weight in images)
+
+    def search_deals_batched(self, deals, curr_turn, lead_pos, trump, table, hand, valid_cards,
+                             card_stats, deal_moments=None):
+        '''
+        Same as search_deals but holds blocks of deals as arrays and plays one card
+        in every future of the block at once
+
+        Every future in a batch has played the same number of cards, so the round and
+        cards played are shared while hands, table, turn, lead and points are arrays
+        '''
+        team = curr_turn % 2
+        trump_mask = SUIT_MASKS[trump]
+        # futures are binned by the points they end on
+        offset = mask_points(trump, (1 << len(CARD_NAMES)) - 1)
+        bins = 2*offset + 1
+        card_index = numpy.full(TRICK_SLOTS, -1)
+        card_index[valid_cards] = numpy.arange(len(valid_cards))
+        hand_mask = 0
+        for card in hand:
+            hand_mask |= 1 << card
+        # a worker gets its chunk as a list, islice only moves on through an iterator
+        deals = iter(deals)
+        for block in iter(lambda: list(itertools.islice(deals, self.batch_size)), []):
+            hands = numpy.zeros((len(block), 4), numpy.int64)
+            for ix,(hands_dealt, _) in enumerate(block):
+                for player,dealt in enumerate(hands_dealt):
+                    for card in dealt:
+                        hands[ix, player] |= 1 << card
+            hands[:, curr_turn] = hand_mask
+            batch = BatchState(hands, numpy.tile(numpy.array(table[self.round]), (len(block), 1)),
+                               numpy.full(len(block), curr_turn), numpy.full(len(block), lead_pos),
+                               numpy.zeros(len(block), numpy.int64), numpy.arange(len(block)))
+            batch.deal = batch.key
+            leaves = numpy.zeros(len(block) * len(valid_cards) * bins, numpy.int64)
+            stack = [(self.round, self.card_played, batch)]
+            stats = self.stats
+            while stack:
+                round, card_played, batch = stack.pop()
+                if stats is not None:
+                    started = time.perf_counter()
+                children = batch.play(trump, card_played)
+                if stats is not None:
+                    stats.legality_time += time.perf_counter() - started
+                    stats.nodes[round*4 + card_played] += len(batch.key)
+                    stats.moves += len(children.key)
+                self.nodes += len(children.key)
+                if self.nodes >= self.next_budget_check:
+                    try:
+                        self.check_budget()
+                    except BudgetExceeded:
+                        # the block is dropped whole like a deal in search_deals
+                        self.out_of_budget = True
+                        return
+                if batch.key is batch.deal:
+                    # the first card played picks which card of the current player this future is for
+                    children.key = children.key * len(valid_cards) + card_index[children.trick[
+                        numpy.arange(len(children.key)), curr_turn]]
+                if card_played < 3:
+                    stack.extend((round, card_played + 1, chunk)
+                                 for chunk in children.split(self.batch_states))
+                    continue
+                if stats is not None:
+                    started = time.perf_counter()
+                if self.hooks:
+                    self.call_hooks(HookEvent.SOLVE_SET_START)
+                children.solve(trump, team)
+                if self.hooks:
+                    self.call_hooks(HookEvent.SOLVE_SET_END)
+                if stats is not None:
+                    stats.add_trick(started, len(children.key))
+                if round >= 7:
+                    leaves += numpy.bincount(children.key * bins + children.points + offset,
+                                             minlength=len(leaves))
+                    continue
+                stack.extend((round + 1, 0, chunk) for chunk in children.split(self.batch_states))
+            leaves = leaves.reshape(len(block), len(valid_cards), bins)
+            points = numpy.arange(bins) - offset
+            for ix,(hands_dealt, images) in enumerate(block):
+                stratum = None
+                if deal_moments is not None and self.stratified:
+                    stratum = tuple(0 if player == curr_turn else
+                                    bin(int(hands[ix, player]) & trump_mask).count('1')
+                                    for player in range(4))
+                for card_ix,card in enumerate(valid_cards):
+                    counts = leaves[ix, card_ix]
+                    found = counts.nonzero()[0]
+                    # credit every deal this one stands for, with the card it plays there
+                    for card_map, weight in images:
+                        target = card_stats[card_map[card] if card_map else card]
+                        for bin_ix in found.tolist():
+                            target.add(bin_ix - offset, int(counts[bin_ix]) * weight)
+                    if deal_moments is not None:
+                        add_deal_moments(deal_moments, card, stratum, int(counts @ points),
+                                         int(counts.sum()))
+                self.deals_searched += sum(weight for _, weight in images)
+
+    def search_deals_parallel(self, deals, curr_turn, lead_pos, trump, table, hand, valid_cards,
+                              deal_moments=None):
+        '''
+        Splits the deals into chunks searched by a pool of worker processes,
+        returns the futures summed up per card
+
+        Workers stop on the same deadline, each chunk gets the node budget left when it is
+        sent so chunks already out can go over it between them
+        '''
+        card_stats = {card: self.new_aggregate() for card in valid_cards}
+        worker = Game()
+        worker.trump = self.trump
+        worker.round = self.round
+        worker.card_played = self.card_played
+        worker.print_level = self.print_level
+        worker.search_mode = self.search_mode
+        worker.stratified = self.stratified
+        worker.batch_size = self.batch_size
+        worker.batch_states = self.batch_states
+        worker.histogram_bins = self.histogram_bins
+        worker.keep_leaves = self.keep_leaves
+        worker.stats = None if self.stats is None else SearchStats()
+        worker.transposition = TranspositionTable(self.transposition.max_entries)
+        worker.group_equal_cards = self.group_equal_cards
+        # only the path is sent, every worker maps the same file
+        worker.tablebase = self.tablebase
+        worker.deadline = self.deadline
+        position = (curr_turn, lead_pos, trump, table, hand, valid_cards, deal_moments is not None)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(worker, position)) as pool:
+            pending = set()
+            deals = iter(deals)
+            for chunk in iter(lambda: list(itertools.islice(deals, self.chunk_size)), []):
+                # keep a few chunks queued per worker so the deals are not all held at once
+                if len(pending) >= self.workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.merge_chunk(card_stats, deal_moments, future.result())
+                node_budget = None if self.node_budget is None else self.node_budget - self.nodes
+                if (self.out_of_budget or node_budget is not None and node_budget <= 0
+                        or self.deadline is not None and time.monotonic() >= self.deadline):
+                    self.out_of_budget = True
+                    # chunks no worker has started would only stop straight away
+                    for future in pending:
+                        future.cancel()
+                    break
+                pending.add(pool.submit(_search_chunk, chunk, node_budget))
+            for future in wait(pending).done:
+                if not future.cancelled():
+                    self.merge_chunk(card_stats, deal_moments, future.result())
+        return card_stats
+
+    def merge_chunk(self, card_stats, deal_moments, result):
+        '''Adds the results of a chunk searched by a worker'''
+        chunk_stats, chunk_moments, deals_searched, nodes, out_of_budget, search_stats = result
+        self.deals_searched += deals_searched
+        self.nodes += nodes
+        self.out_of_budget |= out_of_budget
+        if search_stats is not None:
+            self.stats.merge(search_stats)
+        merge_aggregates(card_stats, chunk_stats)
+        if deal_moments is not None:
+            merge_deal_moments(deal_moments, chunk_moments)
+
     def play_card(self, player: Player, cardtoplay: str, round: int, table: Table, deck_played):
         '''
         Plays a card onto the table and increments the players hand
@@ -390,8 +2378,11 @@ class Game:
                     f'{self.table.cards[self.round]}',
                    print_level=PrintLevel.INFO)
 
-    def search_futures(self):
-        '''Play a single turn'''
+    def search_futures(self, return_stats=False):
+        '''
+        Play a single turn, returns the average points per card and with return_stats
+        the SearchStats of the search as well
+        '''
 
         # get the current player
         curr_player = self.players[self.curr_turn]
@@ -402,23 +2393,47 @@ class Game:
                        print_level=PrintLevel.WARNING)
  
         self.print(f'-- start P{curr_player.id} --', print_level=PrintLevel.INFO)
-        # run calculate and get back a dictionary of all points possible per card
+        # run calculate and get back a summary of the points possible per card
+        stats = SearchStats() if return_stats or self.collect_stats else None
         start = time.perf_counter()
-        total_card_points = self.setup_calculate(curr_player, self.lead, self.round)
+        total_card_points = self.setup_calculate(curr_player, self.lead, self.round, stats)
         end = time.perf_counter()
         self.print(f'Possible points: ', newline=False, print_level=PrintLevel.EXTRA_INFO) 
         futures = 0
         for idx,card in enumerate(curr_player.handrounds[self.round]):
-            futures += len(total_card_points[card])
-            self.print(f'{card}:{total_card_points[card]} ',
+            card_stats = total_card_points[card]
+            futures += card_stats.count
+            summary = card_stats.leaves if card_stats.leaves is not None else \
+                f'[{card_stats.low}..{card_stats.high}] n={card_stats.count}'
+            self.print(f'{card}:{summary} ',
                        print_level=PrintLevel.EXTRA_INFO,
                        newline=False)
         self.print('', print_level=PrintLevel.EXTRA_INFO)
         self.print(f'Searched {futures} futures in {timedelta(seconds=end-start)}',
                    print_level=PrintLevel.INFO)
+        if self.out_of_budget:
+            self.print(f'Out of budget after {self.nodes} nodes, searched {self.coverage:.2%} of deals',
+                       print_level=PrintLevel.INFO)
+            if not futures:
+                self.print(f'P{curr_player.id} ran out of budget before any deal was searched',
+                           print_level=PrintLevel.WARNING)
+
+        if stats is not None:
+            self.print(f'Deals:{stats.deals} nodes:{sum(stats.nodes)} tricks:{stats.tricks} ' \
+                       f'branching:{stats.branching_factor():.2f} ' \
+                       f'deal time:{stats.deal_time:.4f}s legality:{stats.legality_time:.4f}s ' \
+                       f'scoring:{stats.scoring_time:.4f}s', print_level=PrintLevel.INFO)
+
+        if self.standard_errors:
+            self.print(f'Standard error: ', newline=False, print_level=PrintLevel.INFO)
+            for card,error in self.standard_errors.items():
+                self.print(f'{card}:{round(error,3)} ', newline=False, print_level=PrintLevel.INFO)
+            self.print('', print_level=PrintLevel.INFO)
 
-        # sum all possible points per card and average
-        final_points = [sum(points)/len(points) if points else 0 for card,points in total_card_points.items()]
+        # average the points of every possible future per card
+        final_points = [card_stats.mean() for card,card_stats in total_card_points.items()]
+        if return_stats:
+            return final_points, stats
         return final_points
 
     def start(self):
@@ -442,6 +2457,19 @@ class Game:
         if self.errors > 0:
             self.print(f'Errors that occured -> {self.errors}', print_level=PrintLevel.INFO)
 
+    def best_card(self, final_points):
+        '''
+        Returns the card with the most points of the final_points of the current player out of
+        the cards they can play, the first of them when every card has as many points (like
+        when the budget ran out before any deal was searched)
+        '''
+        hand = self.players[self.curr_turn].handrounds[self.round]
+        points = dict(zip(hand, final_points))
+        # cards that can't be played lead to no futures and average 0 points
+        valid = self.get_valid_set(hand, self.lead, self.trump, self.table.cards[self.round],
+                                   self.curr_turn, self.card_played)
+        return max(valid, key=points.__getitem__)
+
     def play(self):
         '''Run through the entire game'''
 
@@ -450,7 +2478,9 @@ class Game:
         while self.round < 8:
 
             # play a turn
+            start = time.perf_counter()
             final_points = self.search_futures()
+            search_time = time.perf_counter() - start
 
             self.print(f'Final points: ', newline=False, print_level=PrintLevel.INFO)
             curr_player = self.players[self.curr_turn]
@@ -459,13 +2489,20 @@ class Game:
             self.print('', print_level=PrintLevel.INFO)
 
             # choose the best card
-            cardtoplay = curr_player.handrounds[self.round][final_points.index(max(final_points))]
+            cardtoplay = self.best_card(final_points)
+            self.decisions.append({'round': self.round, 'player': curr_player.id, 'card': cardtoplay,
+                                   'points': dict(zip(curr_player.handrounds[self.round], final_points)),
+                                   'search_time': search_time})
             self.play_card(curr_player, cardtoplay, self.round, self.table, self.deck_played)
+            if self.drop_played:
+                # make room for the positions the next turns can still reach
+                self.transposition.drop_cards(1 << encode_card(cardtoplay))
             self.print('-- end --', print_level=PrintLevel.INFO)
 
             # create lead if this is the first card in the round
             if self.card_played == 0:
                 self.lead = cardtoplay
+                self.table.leads[self.round] = cardtoplay
 
             # increment turn and cards played
             self.curr_turn = self.curr_turn + 1 if self.curr_turn + 1 < 4 else 0
@@ -492,6 +2529,51 @@ class Game:
         for ix,card in enumerate(self.fulldeck):
             self.players[ix % len(self.players)].hand.append(card)
 
+POSITION_SETTINGS = ('samples', 'seed', 'stratified', 'time_budget', 'node_budget', 'search_mode',
+                     'canonical_deals', 'infer_voids', 'group_equal_cards', 'histogram_bins')
+'''Game attributes a position can set for its search'''
+
+def position_game(position):
+    '''
+    Returns a Game at a position given as a dict, like one json line: the Game fields trump,
+    round, curr_turn, card_played, lead, fulldeck and deck_played, the hand of the player to
+    play (or every hand), the table cards and leads of the rounds so far, settings for
+    the search and the [start, stop) range of deals to search when only a shard is.
+    Raises KeyError, TypeError or ValueError on a position that can't be played
+    '''
+    game = Game()
+    game.print_level = PrintLevel.ERROR
+    game.trump = position['trump']
+    game.round = position['round']
+    game.curr_turn = position['curr_turn']
+    game.card_played = position.get('card_played', 0)
+    game.lead = position.get('lead', '')
+    game.fulldeck = list(position['fulldeck'])
+    game.deck_played = list(position.get('deck_played', []))
+    if not 0 <= game.round < 8 or not 0 <= game.curr_turn < 4 or not 0 <= game.card_played < 4:
+        raise ValueError(f'No turn at round {game.round} player {game.curr_turn} card {game.card_played}')
+    for round, cards in enumerate(position.get('table', [])):
+        game.table.cards[round] = list(cards)
+    for round, lead in enumerate(position.get('leads', [])):
+        game.table.leads[round] = lead
+    hand = position['hand'] if 'hand' in position else position['hands'][game.curr_turn]
+    game.players[game.curr_turn].handrounds[game.round] = list(hand)
+    for card in game.fulldeck + game.deck_played + list(hand):
+        if card not in CARD_CODES:
+            raise ValueError(f'Unknown card {card}')
+    if 'deals' in position:
+        start, stop = position['deals']
+        if not isinstance(start, int) or not isinstance(stop, int) or not 0 <= start <= stop:
+            raise ValueError(f'No deals from {start} to {stop}')
+        game.deal_range = (start, stop)
+    for name, value in position.get('settings', {}).items():
+        if name not in POSITION_SETTINGS:
+            raise ValueError(f'Unknown setting {name}')
+        if name == 'search_mode' and isinstance(value, str):
+            value = SearchMode[value.upper()]
+        setattr(game, name, value)
+    return game
+
 if __name__ == '__main__':
     '''
     # Example set up
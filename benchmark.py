@@ -0,0 +1,200 @@
+import argparse
+import copy
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import belote
+
+SEED = 1
+'''Seed every suite position is dealt from'''
+EXTRA_CARDS = {4: (0,), 5: (0, 4), 6: (0, 4), 7: (0, 4, 8)}
+'''Cards nobody holds added to the deck per round, more unseen cards means more deals'''
+REPEATS = 3
+'''Most searches of a position, the fastest is kept'''
+REPEAT_SECONDS = 1.0
+'''Searches of a position stop repeating once they took this long'''
+
+class SetupOnlyGame(belote.Game):
+    '''Game that sets up every deal and candidate card but skips the search'''
+    def calculate(self, *args):
+        pass
+
+    def minimax(self, *args):
+        return 0
+
+def example_position(game_type, card_played):
+    '''The example from belote.py with card_played cards already on the table'''
+    game = game_type()
+    game.print_level = belote.PrintLevel.ERROR
+    game.round = 5
+    game.trump = '♥'
+    game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦',
+                     '10♦','10♠','9♠','9♥','8♠','8♥','7♥','7♠']
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand[:8 - game.round])
+    for _ in range(card_played):
+        player = game.players[game.curr_turn]
+        card = game.get_valid_set(player.handrounds[game.round], game.lead, game.trump,
+                                  game.table.cards[game.round], game.curr_turn, game.card_played)[0]
+        play_turn(game, player, card)
+    return game
+
+def play_turn(game, player, card):
+    '''Plays the card for the player and moves on to the next player in the round'''
+    game.play_card(player, card, game.round, game.table, game.deck_played)
+    if game.card_played == 0:
+        game.lead = card
+        game.table.leads[game.round] = card
+    game.curr_turn = game.curr_turn + 1 if game.curr_turn + 1 < 4 else 0
+    game.card_played += 1
+
+def suite_position(seed, round, card_played, deck_size):
+    '''
+    A random deck of deck_size cards dealt for the round with card_played random
+    valid cards already on the table, the same for the same arguments
+    '''
+    rng = random.Random(f'{seed}-{round}-{card_played}-{deck_size}')
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.round = round
+    game.trump = rng.choice(belote.SUITS)
+    game.curr_turn = rng.randrange(4)
+    game.fulldeck = rng.sample(belote.CARD_NAMES, deck_size)
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand[:8 - round])
+    for _ in range(card_played):
+        player = game.players[game.curr_turn]
+        play_turn(game, player, rng.choice(game.get_valid_set(
+            player.handrounds[game.round], game.lead, game.trump,
+            game.table.cards[game.round], game.curr_turn, game.card_played)))
+    return game
+
+def suite_positions(seed, rounds):
+    '''Every position of the suite as (name, round, card_played, deck_size)'''
+    for round in rounds:
+        for extra in EXTRA_CARDS[round]:
+            deck_size = 4*(8 - round) + extra
+            for card_played in range(4):
+                yield f'r{round}-c{card_played}-d{deck_size}', round, card_played, deck_size
+
+def time_search(game):
+    start = time.perf_counter()
+    game.search_futures()
+    return time.perf_counter() - start
+
+def search_peak_memory(game):
+    '''
+    Peak bytes allocated by a search of the game over what was allocated before it,
+    the trick table built ahead of it is left out
+    '''
+    tracemalloc.start()
+    try:
+        game.search_futures()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_position(seed, name, round, card_played, deck_size):
+    '''
+    Searches a suite position on a fresh game until REPEATS or REPEAT_SECONDS and keeps
+    the fastest, then once more with allocations traced for the peak memory of the search,
+    run in a fresh process so earlier positions leave nothing behind
+    '''
+    spent = 0.0
+    wall = None
+    for _ in range(REPEATS):
+        game = suite_position(seed, round, card_played, deck_size)
+        belote.build_trick_table(belote.encode_trump(game.trump))
+        search = time_search(game)
+        wall = search if wall is None else min(wall, search)
+        spent += search
+        if spent >= REPEAT_SECONDS:
+            break
+    # traced apart from the timed searches, tracing slows every allocation down
+    peak = search_peak_memory(suite_position(seed, round, card_played, deck_size))
+    return {
+        'name': name,
+        'seed': seed,
+        'round': round,
+        'card_played': card_played,
+        'deck_size': deck_size,
+        'wall': wall,
+        'nodes': game.nodes,
+        'deals': game.deals_searched,
+        'nodes_per_sec': game.nodes / wall if wall else 0.0,
+        'deals_per_sec': game.deals_searched / wall if wall else 0.0,
+        'peak_memory_kb': peak // 1024,
+    }
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(seed, rounds):
+    '''Benchmarks every suite position, returns the results with where they were run'''
+    results = []
+    for position in suite_positions(seed, rounds):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(bench_position, seed, *position).result()
+        print(f'{result["name"]:>12} wall:{result["wall"]:.4f}s nodes:{result["nodes"]} ' \
+              f'deals:{result["deals"]} nodes/s:{result["nodes_per_sec"]:.0f} ' \
+              f'deals/s:{result["deals_per_sec"]:.0f} peak:{result["peak_memory_kb"]}kB')
+        results.append(result)
+    return {'commit': current_commit(), 'python': platform.python_version(), 'positions': results}
+
+def compare(results, baseline):
+    '''Prints the wall time and nodes/sec of each position against the baseline'''
+    before = {position['name']: position for position in baseline['positions']}
+    print(f'Against {baseline.get("commit")}:')
+    for position in results['positions']:
+        old = before.get(position['name'])
+        if old is None:
+            continue
+        speedup = old['wall'] / position['wall'] if position['wall'] else float('inf')
+        nodes = position['nodes_per_sec'] / old['nodes_per_sec'] if old['nodes_per_sec'] else 0.0
+        print(f'{position["name"]:>12} wall:{old["wall"]:.4f}s -> {position["wall"]:.4f}s ' \
+              f'({speedup:.2f}x) nodes/s:{nodes:.2f}x')
+
+def bench_setup_overhead(card_played):
+    '''Times the setup of every deal and candidate card apart from the search itself'''
+    game = example_position(belote.Game, card_played)
+    belote.build_trick_table(belote.encode_trump(game.trump))
+    curr_player = game.players[game.curr_turn]
+    hand_sizes, _ = game.get_hand_sizes(game.curr_turn, game.card_played, game.round)
+    deals = sum(1 for _ in game.get_all_hands(hand_sizes,
+                                               game.deck_played + curr_player.handrounds[game.round]))
+    total = time_search(game)
+    setup = time_search(example_position(SetupOnlyGame, card_played))
+    print(f'card_played:{card_played} deals:{deals} setup:{setup:.4f}s ' \
+          f'search:{total - setup:.4f}s setup share:{setup / total:.1%}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Belote solver benchmarks')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='file the suite results are written to as json')
+    parser.add_argument('--compare', help='results of an earlier run to compare against')
+    parser.add_argument('--rounds', type=int, nargs='+', default=sorted(EXTRA_CARDS),
+                        choices=sorted(EXTRA_CARDS), help='rounds of the suite to run')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--setup-overhead', action='store_true',
+                        help='time setup against search on the example position instead')
+    args = parser.parse_args()
+    if args.setup_overhead:
+        for card_played in range(4):
+            bench_setup_overhead(card_played)
+    else:
+        results = run_suite(args.seed, args.rounds)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                compare(results, json.load(f))
@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+import belote
+
+SHARDS_PER_SLOT = 4
+'''Shards per search slot of the fleet, more shards even out slow deals and lose less to a retry'''
+RETRIES = 3
+'''Times a shard is sent again after the server searching it failed'''
+
+class ShardFailed(Exception):
+    '''A shard of the deals failed every time it was sent'''
+
+def parse_address(address):
+    '''Returns the host and port of a server written host:port, the host defaults to localhost'''
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+async def solve(position, addresses, slots=1, shards=None, retries=RETRIES, timeout=None):
+    '''
+    Searches every deal of a position, split into exact shards of the deals of the turn
+    and sent to the solver servers at addresses, slots shards at a time to each. A shard
+    whose server fails, errors or takes longer than timeout seconds is sent again, to any
+    server, up to retries times, and a server failing that many shards in a row is left out.
+    Returns the futures summed up per card of the hand like setup_calculate, with the deals,
+    nodes, shards and retries of the search
+    '''
+    game = belote.position_game(position)
+    hand = game.players[game.curr_turn].handrounds[game.round]
+    _, _, deal_index = game.get_turn_deals(game.deck_played + hand)
+    shards = shards or len(addresses) * slots * SHARDS_PER_SLOT
+    queue = asyncio.Queue()
+    for shard in range(shards):
+        start, stop = deal_index.shard(shard, shards)
+        if start < stop:
+            queue.put_nowait((start, stop))
+    card_stats = {card: game.new_aggregate() for card in hand}
+    summary = {'deals': 0, 'nodes': 0, 'out_of_budget': False, 'shards': queue.qsize(), 'retries': 0}
+    tries = {}
+    failed = []
+
+    async def search(address, reader, writer, deals):
+        writer.write((json.dumps(position | {'id': deals[0], 'deals': deals},
+                                 ensure_ascii=False) + '\n').encode())
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line:
+            raise ConnectionError(f'{address} closed the connection')
+        reply = json.loads(line)
+        if 'aggregates' not in reply:
+            raise ValueError(reply.get('error', 'the search was cancelled'))
+        return reply
+
+    async def run_slot(address):
+        host, port = parse_address(address)
+        reader = writer = None
+        failures = 0
+        try:
+            while failures <= retries:
+                deals = await queue.get()
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                    reply = await search(address, reader, writer, deals)
+                except (OSError, asyncio.TimeoutError, ValueError) as error:
+                    if writer is not None:
+                        writer.close()
+                        reader = writer = None
+                    failures += 1
+                    tries[deals] = tries.get(deals, 0) + 1
+                    if tries[deals] > retries:
+                        failed.append(f'deals {deals[0]} to {deals[1]} on {address}: {error}')
+                    else:
+                        summary['retries'] += 1
+                        queue.put_nowait(deals)
+                    # only done after it is queued again so the join waits for it
+                    queue.task_done()
+                    continue
+                failures = 0
+                belote.merge_aggregates(card_stats, {card: belote.PointsAggregate.from_dict(stats)
+                                                     for card, stats in reply['aggregates'].items()})
+                summary['deals'] += reply['deals']
+                summary['nodes'] += reply['nodes']
+                summary['out_of_budget'] |= reply['out_of_budget']
+                queue.task_done()
+        finally:
+            if writer is not None:
+                writer.close()
+
+    start = time.perf_counter()
+    searching = [asyncio.create_task(run_slot(address)) for address in addresses for _ in range(slots)]
+    finished = asyncio.create_task(queue.join())
+    try:
+        # every slot gives up when the servers are all down
+        left = set(searching)
+        while left and not finished.done():
+            done, left = await asyncio.wait(left | {finished}, return_when=asyncio.FIRST_COMPLETED)
+            left.discard(finished)
+            for task in done - {finished}:
+                task.result()
+        complete = finished.done()
+    finally:
+        for task in searching + [finished]:
+            task.cancel()
+        await asyncio.gather(*searching, finished, return_exceptions=True)
+    if failed:
+        raise ShardFailed(f'{len(failed)} shards failed, {failed[0]}')
+    if not complete:
+        raise ShardFailed(f'Every server failed with {queue.qsize()} shards left')
+    summary['coverage'] = summary['deals'] / deal_index.count if deal_index.count else 1.0
+    summary['search_time'] = time.perf_counter() - start
+    return card_stats, summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Searches every deal of one belote position split between '
+                                     'solver servers (server.py), the position read as json')
+    parser.add_argument('position', nargs='?', default='-', help='file of the position, - reads stdin')
+    parser.add_argument('--servers', nargs='+', required=True, help='solver servers as host:port')
+    parser.add_argument('--slots', type=int, default=1,
+                        help='shards searched at once on each server, up to its workers')
+    parser.add_argument('--shards', type=int, default=None,
+                        help=f'shards the deals are split into, {SHARDS_PER_SLOT} per slot when not given')
+    parser.add_argument('--retries', type=int, default=RETRIES)
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds a shard may take before it is sent again')
+    args = parser.parse_args()
+    source = sys.stdin if args.position == '-' else open(args.position)
+    with source:
+        position = json.load(source)
+    try:
+        card_stats, summary = asyncio.run(solve(position, args.servers, args.slots, args.shards,
+                                                args.retries, args.timeout))
+    except ShardFailed as error:
+        parser.exit(1, f'{error}\n')
+    print(json.dumps({'points': {card: stats.mean() for card, stats in card_stats.items()}} | summary,
+                     indent=2, ensure_ascii=False))
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import belote
+
+CACHE_SIZE = 4096
+'''Solved positions kept, the least recently used is dropped first'''
+MAX_QUEUED = 256
+'''Queries held at once, waiting or searching, past it no client is read until one is answered'''
+
+_worker_cancelled = None
+'''Cancel flag per search slot, shared with the server'''
+_worker_transposition = None
+'''Transposition table this worker process keeps warm across queries'''
+_worker_tablebase = None
+'''Tablebase this worker process maps, None when the server has none'''
+
+def _init_worker(cancelled, transposition_entries, tablebase):
+    global _worker_cancelled, _worker_transposition, _worker_tablebase
+    _worker_cancelled = cancelled
+    _worker_transposition = belote.TranspositionTable(transposition_entries)
+    _worker_tablebase = None if tablebase is None else belote.Tablebase(tablebase)
+    for trump in range(len(belote.SUITS) + 1):
+        belote.build_trick_table(trump)
+
+def solve_position(query, slot):
+    '''
+    Searches a query in a worker with the tables it keeps warm, stopping early once the
+    server flags its slot as cancelled. Returns the reply without the id
+    '''
+    game = belote.position_game(query)
+    game.transposition = _worker_transposition
+    game.tablebase = _worker_tablebase
+
+    def cancel(event, game):
+        # budget checks come every few thousand cards played
+        if _worker_cancelled[slot]:
+            raise belote.BudgetExceeded()
+
+    game.hooks.append(cancel)
+    start = time.perf_counter()
+    if game.deal_range is not None:
+        # a shard of a position split between servers, the coordinator adds the futures up
+        card_stats = game.setup_calculate(game.players[game.curr_turn], game.lead, game.round)
+        reply = {'aggregates': {card: stats.as_dict() for card, stats in card_stats.items()}}
+    else:
+        points = game.search_futures()
+        reply = {
+            'points': dict(zip(game.players[game.curr_turn].handrounds[game.round], points)),
+            'standard_errors': game.standard_errors,
+            'coverage': game.coverage,
+        }
+    return reply | {
+        'out_of_budget': game.out_of_budget,
+        'deals': game.deals_searched,
+        'nodes': game.nodes,
+        'search_time': time.perf_counter() - start,
+    }
+
+def query_key(query):
+    '''Returns the cache key of a query, everything but its id'''
+    return json.dumps({name: value for name, value in query.items() if name != 'id'},
+                      sort_keys=True, ensure_ascii=False)
+
+class SolverServer:
+    '''
+    Answers position queries sent as json lines over a socket, one reply line per query
+    with the same id, searched in a pool of worker processes that keep their tables warm
+
+    A query with "deals": [start, stop] only searches that shard of the deals and replies
+    with the futures summed up per card instead of the points, see coordinator.py.
+    A query is cancelled with {"cancel": id}. Searches that ran to the end are cached,
+    and past max_queued queries held no client is read so a burst waits in the sockets
+    '''
+    def __init__(self, workers=None, cache_size=CACHE_SIZE, max_queued=MAX_QUEUED,
+                 transposition_entries=1 << 20, tablebase=None):
+        self.workers = workers or os.cpu_count() or 1
+        '''Processes searching queries'''
+        self.cache = collections.OrderedDict()
+        '''Query key to its reply, least recently used first'''
+        self.cache_size = cache_size
+        '''Most replies cached'''
+        self.hits = 0
+        '''Tracks how many queries were answered from the cache'''
+        self.queued = asyncio.Semaphore(max_queued)
+        '''Queries that can still be held before clients stop being read'''
+        self.running = asyncio.Semaphore(self.workers)
+        '''Searches that can still be sent to the workers'''
+        self.free_slots = list(range(self.workers))
+        '''Slots of the cancel flags not used by a running search'''
+        # forked workers would hold on to the sockets of clients connected when they start
+        self.context = multiprocessing.get_context('spawn')
+        '''Multiprocessing context the workers are started with'''
+        self.cancelled = self.context.RawArray('b', self.workers)
+        '''Cancel flag per slot, read by the workers'''
+        self.worker_args = (self.cancelled, transposition_entries, tablebase)
+        '''Arguments every worker process is started with'''
+        self.pool = None
+        '''Worker processes, kept until one of them dies'''
+        self.start_pool()
+
+    def start_pool(self):
+        '''Starts a new pool of worker processes, the old one can't be used once a worker died'''
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                        initializer=_init_worker, initargs=self.worker_args)
+
+    async def answer(self, query):
+        '''Returns the reply to a query from the cache or a worker'''
+        key = query_key(query)
+        reply = self.cache.get(key)
+        if reply is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return reply | {'cached': True}
+        async with self.running:
+            slot = self.free_slots.pop()
+            self.cancelled[slot] = 0
+            pool = self.pool
+            try:
+                future = asyncio.get_running_loop().run_in_executor(pool, solve_position, query, slot)
+            except BrokenProcessPool:
+                self.free_slots.append(slot)
+                self.restart_pool(pool)
+                raise
+            future.add_done_callback(lambda _: self.free_slots.append(slot))
+            try:
+                reply = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the worker can't be interrupted, it stops at its next check
+                self.cancelled[slot] = 1
+                await asyncio.wait([future])
+                raise
+            except BrokenProcessPool:
+                self.restart_pool(pool)
+                raise
+        if not reply['out_of_budget']:
+            self.cache[key] = reply
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return reply | {'cached': False}
+
+    def restart_pool(self, pool):
+        '''Replaces the pool after a worker died, unless another search already did'''
+        if self.pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.start_pool()
+
+    async def respond(self, query, search, writer):
+        '''Writes the reply of a search once it is done, even when it was cancelled before it started'''
+        try:
+            reply = await search
+        except asyncio.CancelledError:
+            reply = {'cancelled': True}
+        except Exception as error:
+            # the client always gets a reply, whatever went wrong with the query or the worker
+            reply = {'error': f'{type(error).__name__}: {error}'}
+        finally:
+            self.queued.release()
+        if not writer.is_closing():
+            writer.write((json.dumps({'id': query.get('id')} | reply, ensure_ascii=False) + '\n').encode())
+            await writer.drain()
+
+    async def handle(self, reader, writer):
+        '''Reads the queries of one client until it disconnects, its searches left are cancelled'''
+        searches = {}
+        replies = set()
+        try:
+            while True:
+                await self.queued.acquire()
+                line = await reader.readline()
+                if not line:
+                    self.queued.release()
+                    break
+                try:
+                    query = json.loads(line)
+                    if not isinstance(query, dict):
+                        raise ValueError('A query is a json object')
+                except ValueError as error:
+                    self.queued.release()
+                    writer.write((json.dumps({'id': None, 'error': str(error)}) + '\n').encode())
+                    continue
+                if 'cancel' in query:
+                    self.queued.release()
+                    search = searches.get(query['cancel'])
+                    if search is not None:
+                        search.cancel()
+                    continue
+                search = asyncio.create_task(self.answer(query))
+                searches[query.get('id')] = search
+                search.add_done_callback(lambda search, id=query.get('id'):
+                                         searches.pop(id) if searches.get(id) is search else None)
+                reply = asyncio.create_task(self.respond(query, search, writer))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+        finally:
+            for search in list(searches.values()):
+                search.cancel()
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        '''Serves on a unix socket at path when given, else on the tcp host and port, until cancelled'''
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Belote solver answering position queries over a socket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='unix socket path to serve on instead of tcp')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes searching queries, every core when not given')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE)
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED)
+    parser.add_argument('--tablebase', help='tablebase file the workers look endgames up in')
+    args = parser.parse_args()
+    solver = SolverServer(args.workers, args.cache_size, args.max_queued, tablebase=args.tablebase)
+    try:
+        asyncio.run(solver.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        solver.close()
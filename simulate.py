@@ -0,0 +1,117 @@
+import argparse
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import belote
+
+def deal_game(seed, index, round, deck_size):
+    '''
+    A game started at round with a random deck of deck_size cards, trump and first player,
+    the same for the same seed and index. Cards beyond the hands are held by nobody
+    '''
+    rng = random.Random(f'{seed}-{index}')
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.round = round
+    game.trump = rng.choice(belote.SUITS)
+    game.curr_turn = rng.randrange(4)
+    game.fulldeck = rng.sample(belote.CARD_NAMES, deck_size)
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = p.hand[:8 - round]
+    return game
+
+def play_game(seed, index, round, deck_size, settings):
+    '''Plays a dealt game to the end with the Game attributes in settings, returns its result'''
+    game = deal_game(seed, index, round, deck_size)
+    for name, value in settings.items():
+        setattr(game, name, value)
+    if game.samples > 0 and game.seed is None:
+        game.seed = f'{seed}-{index}'
+    hands = [p.handrounds[round] for p in game.players]
+    first_turn = game.curr_turn
+    game.play()
+    return {
+        'game': index,
+        'seed': seed,
+        'round': round,
+        'trump': game.trump,
+        'first_turn': first_turn,
+        'hands': hands,
+        'team_points': game.team_points,
+        'errors': game.errors,
+        'search_time': sum(decision['search_time'] for decision in game.decisions),
+        'decisions': game.decisions,
+    }
+
+def percentile(values, share):
+    '''Nearest rank percentile of the values, 0 when there are none'''
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(share * len(values) + 0.5) - 1))]
+
+def summarize(results):
+    '''Returns the win rates per team and the search latency percentiles of the games played'''
+    games = len(results)
+    wins = [0, 0]
+    ties = 0
+    for result in results:
+        a, b = result['team_points']
+        if a == b:
+            ties += 1
+        else:
+            wins[0 if a > b else 1] += 1
+    latencies = [decision['search_time'] for result in results for decision in result['decisions']]
+    return {
+        'games': games,
+        'win_rate': [count / games if games else 0.0 for count in wins],
+        'tie_rate': ties / games if games else 0.0,
+        'decisions': len(latencies),
+        'latency': {f'p{int(share * 100)}': percentile(latencies, share)
+                    for share in (0.5, 0.9, 0.99)} | {'max': max(latencies, default=0.0)},
+    }
+
+def simulate(games, seed, round, deck_size, settings, workers, output):
+    '''
+    Plays the games across worker processes, writing each result to output as
+    one json line as soon as it finishes, returns the summary of every game
+    '''
+    results = []
+    with open(output, 'w') as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_game, seed, index, round, deck_size, settings)
+                   for index in range(games)]
+        for future in as_completed(futures):
+            result = future.result()
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            results.append(result)
+    return summarize(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plays many seeded belote games against itself')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--round', type=int, default=5, choices=range(8),
+                        help='round the games start at, earlier rounds search far more deals')
+    parser.add_argument('--deck-size', type=int,
+                        help='cards in the deck, the cards in the hands when not given')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes playing games, every core when not given')
+    parser.add_argument('--samples', type=int, default=0,
+                        help='random deals searched per turn, 0 searches every deal')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='seconds a turn may search for')
+    parser.add_argument('--minimax', action='store_true',
+                        help='play the best card for both teams instead of the best average')
+    parser.add_argument('--output', default='games.jsonl', help='file the game results are written to')
+    args = parser.parse_args()
+    deck_size = args.deck_size or 4*(8 - args.round)
+    if not 4*(8 - args.round) <= deck_size <= len(belote.CARD_NAMES):
+        parser.error(f'--deck-size must be between {4*(8 - args.round)} and {len(belote.CARD_NAMES)}')
+    settings = {'samples': args.samples, 'time_budget': args.time_budget}
+    if args.minimax:
+        settings['search_mode'] = belote.SearchMode.MINIMAX
+    summary = simulate(args.games, args.seed, args.round, deck_size, settings, args.workers,
+                       args.output)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,28 @@
+import argparse
+import time
+import belote
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solves every belote endgame of a deck ahead of time')
+    parser.add_argument('--deck', nargs='+', required=True, choices=belote.CARD_NAMES, metavar='CARD',
+                        help='cards the games are played with, like the Game fulldeck')
+    parser.add_argument('--cards', type=int, default=2,
+                        help='most cards per player of a stored endgame, every card more takes far longer')
+    parser.add_argument('--trumps', nargs='+', default=belote.SUITS, choices=belote.SUITS)
+    parser.add_argument('--workers', type=int, default=1, help='processes solving endgames')
+    parser.add_argument('--output', default='tablebase.bin', help='file the tablebase is written to')
+    parser.add_argument('--max-positions', type=int, default=belote.TABLEBASE_POSITIONS,
+                        help='most round starts to solve, they are all held in memory until written')
+    args = parser.parse_args()
+    if not 2 <= args.cards <= len(args.deck) // 4:
+        parser.error(f'--cards must be between 2 and {len(args.deck) // 4} for {len(args.deck)} cards')
+    start = time.perf_counter()
+    try:
+        belote.build_tablebase(args.output, args.deck, args.cards, args.trumps, args.workers,
+                               args.max_positions)
+    except ValueError as error:
+        parser.error(str(error))
+    tablebase = belote.Tablebase(args.output)
+    for (trump, size), (values, _, leaves, _) in sorted(tablebase.sections.items()):
+        print(f'{belote.SUITS[trump]} {size} cards: {len(values)} endgames {len(leaves)} leaves')
+    print(f'Built {args.output} in {time.perf_counter() - start:.1f}s')
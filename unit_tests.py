@@ -1,5 +1,15 @@
+import asyncio
 import copy
+import json
+import os
+import pickle
+import random
+import tempfile
+import time
+import analyze
 import belote
+import coordinator
+import server
 
 def test1111():
     game = belote.Game()
@@ -213,6 +223,627 @@ def test_valid_sets_cut_no_higher_trump():
         return False
     return True
 
+def test_card_encoding():
+    cards = ['A♣','10♦','J♥','7♠']
+    codes = [belote.encode_card(card) for card in cards]
+    decoded = [belote.decode_card(code) for code in codes]
+    points = [belote.cardPoints(card, '♥') for card in cards]
+    ans = [11, 10, 20, 0]
+
+    if decoded != cards or points != ans or belote.encode_card('') != belote.NO_CARD:
+        print(f'Expected {cards} {ans} got {decoded} {points}')
+        return False
+    return True
+
+def test_transposition_table_same_points():
+    points = []
+    for size in [0, 1 << 20]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.transposition = belote.TranspositionTable(size)
+        game.trump = '♥'
+        game.round = 5
+        game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        points.append(game.search_futures())
+    if points[0] != points[1] or not game.transposition.hits:
+        print(f'Expected {points[0]} got {points[1]} with {game.transposition.hits} hits')
+        return False
+    return True
+
+def test_minimax_mode():
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.search_mode = belote.SearchMode.MINIMAX
+    game.trump = '♥'
+    game.round = 5
+    game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand)
+    final_points = [round(points, 3) for points in game.search_futures()]
+    score = [5.208, -17.81, 3.167]
+
+    if final_points != score:
+        print(f'Expected {score} got {final_points}')
+        return False
+    return True
+
+def test_parallel_same_points():
+    points = []
+    for workers in [1, 2]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.workers = workers
+        game.chunk_size = 4
+        game.trump = '♥'
+        game.round = 5
+        game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        points.append(game.search_futures())
+    if points[0] != points[1]:
+        print(f'Expected {points[0]} got {points[1]}')
+        return False
+    return True
+
+def test_sampled_deals_repeatable():
+    points = []
+    errors = []
+    for _ in range(2):
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.samples = 20
+        game.seed = 3
+        game.stratified = True
+        game.trump = '♥'
+        game.round = 5
+        game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        points.append(game.search_futures())
+        errors.append(game.standard_errors)
+    if points[0] != points[1] or errors[0] != errors[1] or len(errors[0]) != 3:
+        print(f'Expected {points[0]} {errors[0]} got {points[1]} {errors[1]}')
+        return False
+    return True
+
+def test_deal_classes_same_points():
+    points = []
+    for canonical in [False, True]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.canonical_deals = canonical
+        game.trump = '♥'
+        game.round = 5
+        game.curr_turn = 1
+        game.fulldeck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        points.append(game.search_futures())
+    hand = game.players[game.curr_turn].handrounds[game.round]
+    hand_sizes, _ = game.get_hand_sizes(game.curr_turn, game.card_played, game.round)
+    deals = len(list(game.get_all_hands(hand_sizes, hand)))
+    classes = list(game.get_deal_classes(hand_sizes, hand, hand, game.table.cards[game.round]))
+    weights = sum(weight for _, images in classes for _, weight in images)
+    if points[0] != points[1] or weights != deals or len(classes) >= deals:
+        print(f'Expected {points[0]} {deals} got {points[1]} {weights} in {len(classes)} classes')
+        return False
+    return True
+
+def test_resolve_tricks():
+    game = belote.Game()
+    trump = '♥'
+    tricks = [
+        (['A♣','Q♥','10♦','8♠'], 'A♣'),
+        (['7♥','K♦','Q♥',''], '7♥'),
+        (['9♣','10♦','J♣','K♦'], 'K♦'),
+        (['8♦','7♦','9♦','10♣'], '7♦'),
+    ]
+    ans = [game.solveSet(trump, lead, cards) for cards, lead in tricks]
+    encoded = [[belote.encode_card(card) for card in cards] for cards, _ in tricks]
+    leads = [cards.index(lead) for cards, lead in tricks]
+    totals, winners = belote.resolve_tricks(belote.encode_trump(trump), leads, encoded)
+    solved = [(max(points), winner) for points, winner in ans]
+
+    if solved != list(zip(totals.tolist(), winners.tolist())):
+        print(f'Expected {solved} got {list(zip(totals, winners))}')
+        return False
+    return True
+
+def test_batched_same_points():
+    points = []
+    # workers are sent their chunks of deals as lists
+    for batch_size, workers in [(0, 1), (8, 1), (8, 2)]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.batch_size = batch_size
+        game.batch_states = 64
+        game.workers = workers
+        game.chunk_size = 3
+        game.trump = '♠'
+        game.round = 5
+        game.curr_turn = 2
+        game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        points.append(game.search_futures())
+    if points[0] != points[1] or points[0] != points[2]:
+        print(f'Expected {points[0]} got {points[1:]}')
+        return False
+    return True
+
+def test_node_budget_partial_coverage():
+    results = []
+    for node_budget in [None, 50]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.node_budget = node_budget
+        game.trump = '♥'
+        game.round = 5
+        game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        game.search_futures()
+        results.append((game.out_of_budget, game.coverage))
+    if results[0] != (False, 1.0) or not results[1][0] or not 0 <= results[1][1] < 1:
+        print(f'Expected [(False, 1.0), (True, <1)] got {results}')
+        return False
+    return True
+
+def test_points_aggregate_matches_leaves():
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.keep_leaves = True
+    game.histogram_bins = 16
+    game.trump = '♥'
+    game.round = 5
+    game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand)
+    curr_player = game.players[game.curr_turn]
+    for stats in game.setup_calculate(curr_player, game.lead, game.round).values():
+        leaves = stats.leaves
+        expected = (len(leaves), sum(leaves), sum(leaf * leaf for leaf in leaves),
+                    min(leaves), max(leaves), len(leaves))
+        got = (stats.count, stats.total, stats.squares, stats.low, stats.high, sum(stats.histogram))
+        if got != expected:
+            print(f'Expected {expected} got {got}')
+            return False
+    return True
+
+def test_search_stats_and_hooks():
+    points = []
+    for return_stats in [False, True]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        events = []
+        game.hooks.append(lambda event, _: events.append(event))
+        game.trump = '♥'
+        game.round = 5
+        game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦','10♦','10♠','9♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        points.append(game.search_futures(return_stats))
+    final_points, stats = points[1]
+    starts = events.count(belote.HookEvent.CALCULATE_START)
+    solved = events.count(belote.HookEvent.SOLVE_SET_START)
+    if (points[0] != final_points or stats.deals == 0 or not stats.tricks
+            or stats.nodes[game.round*4] != stats.deals or stats.branching_factor() < 1
+            or starts == 0 or starts != events.count(belote.HookEvent.CALCULATE_END)
+            or solved != stats.tricks or solved != events.count(belote.HookEvent.SOLVE_SET_END)):
+        print(f'Expected {points[0]} got {final_points} {vars(stats)} hooks:{events}')
+        return False
+    return True
+
+def test_trace_file_replays_sets():
+    path = os.path.join(tempfile.mkdtemp(), 'trace.bin')
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.trace = belote.TraceRecorder(capacity=4, path=path)
+    game.trump = '♥'
+    game.round = 6
+    game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦']
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand)
+    game.search_futures()
+    game.trace.close()
+    replayed = list(belote.read_trace(path))
+    if (len(replayed) != game.trace.count or len(game.trace.records) != 4
+            or replayed[-4:] != game.trace.sets()):
+        print(f'Expected {game.trace.count} sets ending in {game.trace.sets()} ' \
+              f'got {len(replayed)} ending in {replayed[-4:]}')
+        return False
+    return True
+
+def test_play_records_decisions():
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.trump = '♥'
+    game.round = 6
+    game.fulldeck = ['A♠','A♣','K♦','K♣','Q♠','Q♥','J♠','J♦']
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand)
+    game.play()
+    played = [card for round in game.table.cards[6:] for card in round]
+    cards = [decision['card'] for decision in game.decisions]
+    if sorted(cards) != sorted(played) or len(cards) != 8 \
+            or any(decision['card'] not in decision['points'] for decision in game.decisions):
+        print(f'Expected {played} got {game.decisions}')
+        return False
+    return True
+
+def test_play_drops_positions_ruled_out():
+    games = []
+    for drop_played in (True, False):
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.trump = '♥'
+        game.round = 5
+        game.curr_turn = 1
+        game.fulldeck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        game.drop_played = drop_played
+        game.play()
+        games.append(game)
+    played = belote.encode_hand(games[0].deck_played)
+    held = played | played << 32 | played << 64 | played << 96
+    decisions = [[(decision['card'], decision['points']) for decision in game.decisions] for game in games]
+    if decisions[0] != decisions[1] or any(key & held for key in games[0].transposition.entries):
+        print(f'Expected {decisions[1]} got {decisions[0]}')
+        return False
+    return True
+
+def test_play_only_plays_valid_cards():
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.trump = '♥'
+    game.lead = 'K♠'
+    game.round = 6
+    game.curr_turn = 3
+    game.card_played = 3
+    game.fulldeck = ['K♠','Q♠','J♠','7♠','8♣','9♣','10♦','A♦']
+    game.deck_played = ['K♠','Q♠','J♠']
+    game.table.cards[game.round] = ['K♠','Q♠','J♠','']
+    game.table.leads[game.round] = 'K♠'
+    for p, card in zip(game.players[:3], ['8♣','9♣','10♦']):
+        p.handrounds[7] = [card]
+    game.players[3].handrounds[6] = ['7♠','A♦']
+    game.play()
+    # following spades loses every point, A♦ averages more only because it can't be played
+    if game.decisions[0]['card'] != '7♠' or game.decisions[0]['points']['7♠'] >= 0:
+        print(f'Expected 7♠ got {game.decisions[0]}')
+        return False
+    return True
+
+def test_deal_index_random_access():
+    game = belote.Game()
+    game.fulldeck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    hand_sizes = [0, 3, 3, 3]
+    deals = list(game.get_all_hands(hand_sizes, game.fulldeck[:3]))
+    index = game.get_deal_index(hand_sizes, game.fulldeck[:3])
+    shards = [list(index.deals(*index.shard(shard, 7))) for shard in range(7)]
+    picked = range(0, len(deals), 97)
+    if (index.count != len(deals) or [deal for shard in shards for deal in shard] != deals
+            or [index.deal(ix) for ix in picked] != [deals[ix] for ix in picked]
+            or [index.index(deals[ix]) for ix in picked] != list(picked)
+            or list(index.deals(500, 510)) != deals[500:510]):
+        print(f'Expected {len(deals)} deals got {index.count} in shards {[len(s) for s in shards]}')
+        return False
+    return True
+
+def test_void_inference_prunes_deals():
+    points = []
+    for canonical in [False, True]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.canonical_deals = canonical
+        game.trump = '♥'
+        game.round = 5
+        game.curr_turn = 1
+        game.fulldeck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        # player 3 played a spade on a club lead won by the other team so holds no clubs or trumps
+        game.table.cards[4] = ['A♣','7♣','10♣','J♠']
+        game.table.leads[4] = 'A♣'
+        game.deck_played = copy.copy(game.table.cards[4])
+        points.append(game.search_futures())
+    hand = game.players[game.curr_turn].handrounds[game.round]
+    known = game.deck_played + hand
+    hand_sizes, _ = game.get_hand_sizes(game.curr_turn, game.card_played, game.round)
+    excluded = game.get_excluded_cards([c for c in game.fulldeck if c not in known])
+    deals = list(game.get_all_hands(hand_sizes, known, excluded))
+    voids = {card for card in game.fulldeck if card[-1] in '♣♥' and card not in known}
+    possible = [deal for deal in game.get_all_hands(hand_sizes, known)
+                if not voids.intersection(deal[3])]
+    if points[0] != points[1] or excluded != [set(), set(), set(), voids] or deals != possible:
+        print(f'Expected {points[0]} {len(possible)} got {points[1]} {len(deals)} excluding {excluded}')
+        return False
+    return True
+
+def test_tablebase_matches_search():
+    deck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦']
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'tablebase.bin')
+        # hands of 1 card are never looked up and 8400 round starts are over the limit
+        for cards, max_positions in [(1, belote.TABLEBASE_POSITIONS), (2, 8399)]:
+            try:
+                belote.build_tablebase(path, deck, cards, ['♥', '♣'], max_positions=max_positions)
+                print(f'Expected {cards} cards with at most {max_positions} round starts to be refused')
+                return False
+            except ValueError:
+                pass
+        if os.path.exists(path):
+            print('Expected no tablebase written for refused builds')
+            return False
+        belote.build_tablebase(path, deck, 2, ['♥', '♣'], max_positions=8400)
+        tablebase = pickle.loads(pickle.dumps(belote.Tablebase(path)))
+        game = belote.Game()
+        game.transposition.max_entries = 0
+        rng = random.Random(1)
+        for _ in range(20):
+            trump = belote.encode_trump(rng.choice(['♥', '♣']))
+            cards = [belote.encode_card(card) for card in rng.sample(deck, 8)]
+            orders = [cards[ix*2:ix*2 + 2] for ix in range(4)]
+            hands = [sum(1 << card for card in order) for order in orders]
+            leader = rng.randrange(4)
+            table = [[belote.NO_CARD] * 4 for _ in range(8)]
+            card_points = {}
+            game.calculate(hands, orders, leader, 0, leader, trump, 6, table, 0, card_points, 0)
+            card_points = [leaf for leaf, count in card_points.items() for _ in range(count)]
+            best = game.minimax(hands, orders, leader, 0, leader, trump, 6, table, 0,
+                                -belote.MAX_POINTS, belote.MAX_POINTS, 0)
+            leaves = sorted(leaf for leaf, count in tablebase.leaves(hands, leader, trump)
+                            for _ in range(count))
+            if leaves != sorted(card_points) or tablebase.value(hands, leader, trump) != best:
+                print(f'Expected {sorted(card_points)} {best} got {leaves} {tablebase.value(hands, leader, trump)}')
+                return False
+        tablebase.close()
+    return True
+
+def test_equal_cards_searched_once():
+    results = []
+    for grouping in [False, True]:
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.group_equal_cards = grouping
+        game.transposition.max_entries = 0
+        game.trump = '♥'
+        game.round = 5
+        game.curr_turn = 1
+        # off suit 9s, 8s and 7s and the 8 and 7 of trumps score and win alike
+        game.fulldeck = ['9♠','8♥','8♣','7♠','9♣','7♥','8♠','7♣','A♠','10♣','K♥','9♦']
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        results.append((game.search_futures(), game.nodes))
+    if results[0][0] != results[1][0] or results[1][1] >= results[0][1]:
+        print(f'Expected {results[0]} got {results[1]}')
+        return False
+    return True
+
+def test_game_state_follows_game():
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.trump = '♥'
+    game.round = 5
+    game.curr_turn = 1
+    game.fulldeck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand)
+    state = belote.GameState.from_game(game)
+    start = state.copy()
+    game.play()
+    for decision in game.decisions:
+        state.play(belote.encode_card(decision['card']))
+        if state.key != state.compute_key():
+            print(f'Expected key {state.compute_key()} got {state.key}')
+            return False
+    replayed = belote.Game()
+    state.to_game(replayed)
+    if (state != belote.GameState.from_game(game) or replayed.team_points != game.team_points
+            or start == state or hash(start.copy()) != hash(start)):
+        print(f'Expected {game.team_points} got {state.team_points} in round {state.round}')
+        return False
+    return True
+
+def test_solver_server_caches_and_cancels():
+    deck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    game = belote.Game()
+    game.print_level = belote.PrintLevel.ERROR
+    game.trump = '♥'
+    game.round = 5
+    game.curr_turn = 1
+    game.fulldeck = deck
+    game.dealAllCards()
+    for p in game.players:
+        p.handrounds[game.round] = copy.copy(p.hand)
+    hand = game.players[game.curr_turn].handrounds[game.round]
+    expected = dict(zip(hand, game.search_futures()))
+    query = {'trump': '♥', 'round': 5, 'curr_turn': 1, 'fulldeck': deck, 'hand': hand}
+    # every card of 24 dealt from round 3 takes far too long, it is only ever cancelled
+    slow = {'id': 'slow', 'trump': '♥', 'round': 3, 'curr_turn': 0, 'fulldeck': belote.CARD_NAMES[:24],
+            'hand': belote.CARD_NAMES[:24:4][:5]}
+
+    async def ask(path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        replies = []
+        for message in [query | {'id': 1}, slow, {'cancel': 'slow'}, query | {'id': 2}]:
+            writer.write((json.dumps(message) + '\n').encode())
+            # the slow query is answered once it is cancelled
+            if message is not slow:
+                replies.append(json.loads(await reader.readline()))
+        writer.close()
+        await writer.wait_closed()
+        return replies
+
+    async def serve(path):
+        solver = server.SolverServer(workers=1)
+        serving = asyncio.create_task(solver.serve(path=path))
+        try:
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            replies = await ask(path)
+            # let the connection see the client is gone
+            await asyncio.sleep(0.1)
+        finally:
+            serving.cancel()
+            solver.close()
+        return replies
+
+    with tempfile.TemporaryDirectory() as folder:
+        replies = {reply['id']: reply for reply in asyncio.run(serve(os.path.join(folder, 'solver.sock')))}
+    if (replies[1]['points'] != expected or replies[1]['cached'] or not replies[2]['cached']
+            or replies[2]['points'] != expected or not replies['slow'].get('cancelled')):
+        print(f'Expected {expected} got {replies}')
+        return False
+    return True
+
+def test_solver_server_replies_to_failures():
+    deck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    query = {'trump': '♥', 'round': 5, 'curr_turn': 1, 'fulldeck': deck, 'hand': deck[1::4]}
+    expected = dict(zip(query['hand'], belote.position_game(query).search_futures()))
+    short = {'id': 'short', 'trump': '♥', 'round': 5, 'curr_turn': 3, 'fulldeck': deck, 'hands': [deck[:3]]}
+
+    async def ask(reader, writer, message):
+        writer.write((json.dumps(message) + '\n').encode())
+        return json.loads(await reader.readline())
+
+    async def serve():
+        solver = server.SolverServer(workers=1)
+        serving = await asyncio.start_server(solver.handle, '127.0.0.1', 0)
+        try:
+            reader, writer = await asyncio.open_connection(*serving.sockets[0].getsockname()[:2])
+            replies = [await ask(reader, writer, short)]
+            # a worker that dies breaks the pool, the server starts a new one
+            for process in list(solver.pool._processes.values()):
+                process.kill()
+            await asyncio.sleep(0.5)
+            replies.append(await ask(reader, writer, query | {'id': 1}))
+            replies.append(await ask(reader, writer, query | {'id': 2}))
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.sleep(0.1)
+        finally:
+            serving.close()
+            solver.close()
+        return replies
+
+    replies = asyncio.run(serve())
+    if (not replies[0].get('error', '').startswith('IndexError')
+            or 'BrokenProcessPool' not in replies[1].get('error', '') and replies[1].get('points') != expected
+            or replies[2].get('points') != expected):
+        print(f'Expected an IndexError then {expected} got {replies}')
+        return False
+    return True
+
+def test_analyze_streams_positions():
+    deck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    expected = {}
+    for curr_turn in (1, 2):
+        game = belote.Game()
+        game.print_level = belote.PrintLevel.ERROR
+        game.trump = '♥'
+        game.round = 5
+        game.curr_turn = curr_turn
+        game.fulldeck = deck
+        game.dealAllCards()
+        for p in game.players:
+            p.handrounds[game.round] = copy.copy(p.hand)
+        hand = game.players[curr_turn].handrounds[game.round]
+        expected[curr_turn] = dict(zip(hand, game.search_futures()))
+    hands = [deck[seat::4] for seat in range(4)]
+    lines = [json.dumps({'id': curr_turn, 'trump': '♥', 'round': 5, 'curr_turn': curr_turn,
+                         'fulldeck': deck, 'hands': hands}) for curr_turn in (1, 2)]
+    # only 7♠ follows the spades led, it is the best card even though A♦ averages more
+    follow = {'trump': '♥', 'round': 6, 'curr_turn': 3, 'card_played': 3, 'lead': 'K♠',
+              'fulldeck': ['K♠','Q♠','J♠','7♠','8♣','9♣','10♦','A♦'], 'deck_played': ['K♠','Q♠','J♠'],
+              'table': [[]] * 6 + [['K♠','Q♠','J♠','']], 'hand': ['7♠','A♦']}
+    short = {name: value for name, value in follow.items() if name != 'hand'} | {'hands': [['K♠','Q♠']]}
+    bad = [json.dumps(short), json.dumps(follow | {'settings': {'histogram_bins': 'x'}})]
+    lines = [lines[0], '', 'not a position', lines[1], *bad, json.dumps(follow)]
+    results = list(analyze.analyze(lines, workers=2))
+    resumed = list(analyze.analyze(lines, workers=2, ordered=False, start=1, done={3, 4, 5, 6}))
+    if ([result['line'] for result in results] != [0, 2, 3, 4, 5, 6]
+            or any('error' not in result for result in results[1:2] + results[3:5])
+            or results[0]['points'] != expected[1] or results[2]['points'] != expected[2]
+            or results[5]['best'] != '7♠' or [result['line'] for result in resumed] != [2]):
+        print(f'Expected {expected} got {results} then {resumed}')
+        return False
+    return True
+
+def test_coordinator_merges_shards():
+    deck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    position = {'trump': '♥', 'round': 5, 'curr_turn': 1, 'fulldeck': deck, 'hand': deck[1::4]}
+    game = belote.position_game(position)
+    expected = game.search_futures()
+
+    async def solve():
+        solver = server.SolverServer(workers=1)
+        serving = await asyncio.start_server(solver.handle, '127.0.0.1', 0)
+        # a server that hangs up on every shard, they are all sent again to the other one
+        failing = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0)
+        try:
+            addresses = [f'127.0.0.1:{s.sockets[0].getsockname()[1]}' for s in (serving, failing)]
+            return await coordinator.solve(position, addresses, shards=6)
+        finally:
+            serving.close()
+            failing.close()
+            solver.close()
+
+    card_stats, summary = asyncio.run(solve())
+    points = [card_stats[card].mean() for card in position['hand']]
+    if points != expected or summary['deals'] != 1680 or summary['coverage'] != 1.0 \
+            or not summary['retries']:
+        print(f'Expected {expected} got {points} {summary}')
+        return False
+    return True
+
+def test_budget_searches_a_uniform_sample():
+    deck = ['A♠','9♣','K♦','K♣','9♠','Q♥','8♣','8♦','7♦','7♠','8♠','9♥']
+    position = {'trump': '♥', 'round': 5, 'curr_turn': 1, 'fulldeck': deck, 'hand': deck[1::4]}
+    expected = belote.position_game(position).search_futures()
+    game = belote.position_game(position | {'settings': {'node_budget': 100000, 'seed': 2}})
+    points = game.search_futures()
+    errors = [game.standard_errors.get(card, 0.0) for card in position['hand']]
+    # the deals the budget got through are a random sample, not the first deals in order
+    if not game.out_of_budget or not all(errors) \
+            or any(abs(point - full) > 4 * error for point, full, error in zip(points, expected, errors)):
+        print(f'Expected {expected} got {points} +- {errors} from {game.deals_searched} deals')
+        return False
+    return True
+
+def test_time_budget_on_many_deals():
+    deck = belote.CARD_NAMES[:20]
+    position = {'trump': '♥', 'round': 3, 'curr_turn': 0, 'fulldeck': deck, 'hand': deck[::4],
+                'settings': {'time_budget': 0.05}}
+    game = belote.position_game(position)
+    start = time.perf_counter()
+    game.search_futures()
+    elapsed = time.perf_counter() - start
+    # the random order of 756756 deals must not be set up before the budget is checked
+    order = list(belote.DealIndex(list(range(8)), [2] * 4).shuffled(random.Random(1)))
+    if not game.out_of_budget or elapsed > 0.25 or sorted(order) != list(range(2520)):
+        print(f'Expected about 0.05s and every deal once got {elapsed:.3f}s and {len(set(order))} deals')
+        return False
+    return True
+
 def run(func):
     print(f'{"Pass" if func() else "Fail"} - {func.__name__}')
 
@@ -226,4 +857,30 @@ if __name__ == '__main__':
     run(test_valid_sets_need_to_cut)
     run(test_valid_sets_cut_higher_trump)
     run(test_valid_sets_cut_no_higher_trump)
+    run(test_card_encoding)
+    run(test_transposition_table_same_points)
+    run(test_minimax_mode)
+    run(test_parallel_same_points)
+    run(test_sampled_deals_repeatable)
+    run(test_deal_classes_same_points)
+    run(test_resolve_tricks)
+    run(test_batched_same_points)
+    run(test_node_budget_partial_coverage)
+    run(test_points_aggregate_matches_leaves)
+    run(test_search_stats_and_hooks)
+    run(test_trace_file_replays_sets)
+    run(test_play_records_decisions)
+    run(test_play_drops_positions_ruled_out)
+    run(test_play_only_plays_valid_cards)
+    run(test_budget_searches_a_uniform_sample)
+    run(test_time_budget_on_many_deals)
+    run(test_deal_index_random_access)
+    run(test_void_inference_prunes_deals)
+    run(test_tablebase_matches_search)
+    run(test_equal_cards_searched_once)
+    run(test_game_state_follows_game)
+    run(test_solver_server_caches_and_cancels)
+    run(test_solver_server_replies_to_failures)
+    run(test_analyze_streams_positions)
+    run(test_coordinator_merges_shards)
 